@@ -1,24 +1,29 @@
 # -*- coding: utf-8 -*-
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 import logging
+import threading
 
 from flatland import Integer, Form
 from flatland.validation import ValueAtLeast
 from logging_helpers import _L
-from microdrop.app_context import get_hub_uri
+from microdrop.app_context import get_app, get_hub_uri
 from microdrop.interfaces import IElectrodeMutator, IPlugin
 from microdrop.plugin_helpers import (StepOptionsController, get_plugin_info,
                                       hub_execute_async)
 from microdrop.plugin_manager import (PluginGlobals, Plugin, ScheduleRequest,
                                       implements)
 from path_helpers import path
-from zmq_plugin.plugin import Plugin as ZmqPlugin, watch_plugin
+from zmq_plugin.plugin import Plugin as ZmqPlugin
 from zmq_plugin.schema import decode_content_data
-import pandas as pd
 import zmq
 
 from ._version import get_versions
-from .states import electrode_states
+from .planning import (ElectrodeGraph, PathIndex, plan_routes,
+                       route_conflicts, route_offsets)
+from .precompile import SchedulePrecompiler
+from .routes import RouteTable, as_route_table, route_changes
+from .schedule import ChannelMap, ScheduleCache, schedule_key
+from .states import STATES_MODES, StatesCursor, monotonic
 
 __version__ = get_versions()['version']
 del get_versions
@@ -27,6 +32,12 @@ logger = logging.getLogger(__name__)
 
 PluginGlobals.push_env('microdrop.managed')
 
+#: Directory of stored all-pairs shortest path tables (see
+#: :class:`planning.PathIndex`).
+#:
+#: .. versionadded:: 2.6
+PATH_INDEX_DIR = path(__file__).parent.joinpath('path_index')
+
 
 class RouteControllerZmqPlugin(ZmqPlugin):
     '''
@@ -34,32 +45,400 @@ class RouteControllerZmqPlugin(ZmqPlugin):
     '''
     def __init__(self, parent, *args, **kwargs):
         self.parent = parent
+        self._poller = None
+        # Command loop thread and stop event (see `start()`).
+        self._thread = None
+        self._stop_event = threading.Event()
+        # Requests queued by other threads, to be sent by the command loop
+        # thread, and socket pair to wake up the loop (see `execute_async()`).
+        self._outbox = deque()
+        self._wake_lock = threading.Lock()
+        self._wake_send = None
+        self._wake_recv = None
+        # Command loop statistics (see `check_sockets()`).
+        self.stats = {'wakeups': 0, 'messages': 0, 'queue_depth': 0,
+                      'max_queue_depth': 0, 'idle_s': 0., 'busy_s': 0.}
         super(RouteControllerZmqPlugin, self).__init__(*args, **kwargs)
 
-    def check_sockets(self):
-        try:
-            msg_frames = self.command_socket.recv_multipart(zmq.NOBLOCK)
-        except zmq.Again:
-            pass
-        else:
+    def check_sockets(self, timeout_ms=0):
+        '''
+        Wait for command socket to become readable, then process *all*
+        queued messages.
+
+        .. versionchanged:: 2.6
+            - Block on a :class:`zmq.Poller` for up to :data:`timeout_ms`
+              milliseconds, drain all queued messages, and record queue
+              depth and idle/busy time in :attr:`stats`.
+            - Send requests queued by other threads (see
+              :meth:`execute_async`).
+
+        Parameters
+        ----------
+        timeout_ms : int, optional
+            Maximum time to wait for a message (in milliseconds).
+        '''
+        if (self._poller is None or self.command_socket not in
+                dict(self._poller.sockets)):
+            self._poller = zmq.Poller()
+            self._poller.register(self.command_socket, zmq.POLLIN)
+            if self._wake_recv is not None:
+                self._poller.register(self._wake_recv, zmq.POLLIN)
+
+        start = monotonic()
+        events = dict(self._poller.poll(timeout_ms))
+        ready = monotonic()
+        self.stats['idle_s'] += ready - start
+        if self._wake_recv is not None and self._wake_recv in events:
+            while True:
+                try:
+                    self._wake_recv.recv(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+            self._send_queued()
+        if self.command_socket not in events:
+            return True
+
+        queue_depth = 0
+        while True:
+            try:
+                msg_frames = self.command_socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            queue_depth += 1
             self.on_command_recv(msg_frames)
+        self.stats['wakeups'] += 1
+        self.stats['messages'] += queue_depth
+        self.stats['queue_depth'] = queue_depth
+        self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'],
+                                            queue_depth)
+        self.stats['busy_s'] += monotonic() - ready
+        if queue_depth > 1:
+            _L().debug('Processed %d queued commands.', queue_depth)
         return True
 
+    def watch(self, stop_event, timeout_ms=100):
+        '''
+        Process commands until :data:`stop_event` is set.
+
+        The loop blocks while the command socket is idle, and checks
+        :data:`stop_event` at least every :data:`timeout_ms` milliseconds.
+
+        .. versionadded:: 2.6
+
+        Parameters
+        ----------
+        stop_event : threading.Event
+            Event to stop loop.
+        timeout_ms : int, optional
+            Maximum time to wait for a message (in milliseconds).
+        '''
+        while not stop_event.is_set():
+            try:
+                self.check_sockets(timeout_ms=timeout_ms)
+            except Exception:
+                _L().error('Error processing commands.', exc_info=True)
+        # Send requests queued before loop stopped.
+        self._send_queued()
+
+    def execute_async(self, *args, **kwargs):
+        '''
+        Send asynchronous request to plugin through the hub.
+
+        .. versionadded:: 2.6
+            ZeroMQ sockets are not thread-safe, so only the command loop
+            thread (see :meth:`start`) uses the command socket while the loop
+            is running.  Requests from other threads (e.g., the GTK main
+            thread on step swap) are queued and the loop is woken up to send
+            them.
+
+        Returns
+        -------
+        str or None
+            Session identifier of request, or ``None`` if request was queued
+            for the command loop thread.
+        '''
+        thread = self._thread
+        if thread is None or thread is threading.current_thread():
+            return super(RouteControllerZmqPlugin, self)\
+                .execute_async(*args, **kwargs)
+        self._outbox.append((args, kwargs))
+        self._wake()
+
+    def _wake(self):
+        '''
+        Wake up command loop, e.g., to send queued requests.
+        '''
+        with self._wake_lock:
+            if self._wake_send is None:
+                return
+            try:
+                self._wake_send.send(b'', zmq.NOBLOCK)
+            except zmq.Again:
+                # Loop has not processed earlier wake-ups yet.
+                pass
+
+    def _send_queued(self):
+        '''
+        Send requests queued by other threads (see :meth:`execute_async`).
+        '''
+        while self._outbox:
+            args, kwargs = self._outbox.popleft()
+            try:
+                super(RouteControllerZmqPlugin, self).execute_async(*args,
+                                                                    **kwargs)
+            except Exception:
+                _L().error('Error sending request.', exc_info=True)
+
+    def start(self, timeout_ms=100):
+        '''
+        Process commands on a dedicated background thread (see
+        :meth:`watch`), leaving the calling (e.g., GTK main) thread free.
+
+        .. versionadded:: 2.6
+
+        Parameters
+        ----------
+        timeout_ms : int, optional
+            Maximum time to wait for a message before checking whether the
+            loop has been stopped (in milliseconds).
+
+        Returns
+        -------
+        threading.Thread
+            Command loop thread.
+        '''
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+        # Socket pair to wake up the loop when other threads queue requests.
+        self._close_wake_sockets()
+        context = zmq.Context.instance()
+        wake_uri = 'inproc://%s-wake-%x' % (self.name, id(self))
+        self._wake_recv = context.socket(zmq.PAIR)
+        self._wake_recv.bind(wake_uri)
+        self._wake_send = context.socket(zmq.PAIR)
+        self._wake_send.connect(wake_uri)
+        self._poller = None
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self.watch,
+                                        args=(self._stop_event, timeout_ms),
+                                        name='%s-commands' % self.name)
+        self._thread.daemon = True
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout_s=1.):
+        '''
+        Stop command loop thread and close sockets.
+
+        .. versionadded:: 2.6
+
+        Parameters
+        ----------
+        timeout_s : float, optional
+            Maximum time to wait for the command loop thread to exit.
+
+        Returns
+        -------
+        bool
+            ``True`` if command loop stopped.  Sockets are only closed once the
+            command loop has stopped.
+        '''
+        self._stop_event.set()
+        self._wake()
+        if self._thread is not None:
+            self._thread.join(timeout_s)
+            if self._thread.is_alive():
+                _L().warning('Timed out waiting for command loop to stop.')
+                return False
+            self._thread = None
+        self._poller = None
+        self._close_wake_sockets()
+        self.close()
+        return True
+
+    def _close_wake_sockets(self):
+        for socket in (self._wake_send, self._wake_recv):
+            if socket is not None:
+                socket.close(linger=0)
+        self._wake_send = self._wake_recv = None
+
+    def on_execute__get_loop_stats(self, request):
+        '''
+        .. versionadded:: 2.6
+
+        Returns
+        -------
+        dict
+            Command loop statistics, i.e., number of ``wakeups`` and
+            processed ``messages``, number of messages processed in the last
+            wakeup (``queue_depth``) and at most (``max_queue_depth``), and
+            time waiting for (``idle_s``) and processing (``busy_s``)
+            messages.
+        '''
+        return dict(self.stats)
+
     def on_execute__add_route(self, request):
+        '''
+        .. versionchanged:: 2.6
+            Accept optional ``return_routes`` flag (see
+            :meth:`DropletPlanningPlugin.add_route`).
+        '''
+        data = decode_content_data(request)
+        try:
+            return self.parent.add_route(data['drop_route'],
+                                         return_routes=data
+                                         .get('return_routes', True))
+        except Exception:
+            _L().error(str(data), exc_info=True)
+
+    def on_execute__check_route_conflicts(self, request):
+        '''
+        .. versionadded:: 2.6
+        '''
+        data = decode_content_data(request)
+        try:
+            return self.parent.check_route_conflicts()
+        except Exception:
+            _L().error(str(data), exc_info=True)
+
+    def on_execute__compact_routes(self, request):
+        '''
+        .. versionadded:: 2.6
+        '''
+        data = decode_content_data(request)
+        try:
+            return self.parent.compact_routes()
+        except Exception:
+            _L().error(str(data), exc_info=True)
+
+    def on_execute__get_electrode_routes(self, request):
+        '''
+        .. versionadded:: 2.6
+        '''
         data = decode_content_data(request)
         try:
-            return self.parent.add_route(data['drop_route'])
+            return self.parent.get_electrode_routes(data['electrode_id'])
         except Exception:
             _L().error(str(data), exc_info=True)
 
     def on_execute__get_routes(self, request):
-        return self.parent.get_routes()
+        '''
+        .. versionchanged:: 2.6
+            Accept optional ``step_number``, ``encoding`` and ``if_version``
+            (see :meth:`DropletPlanningPlugin.get_routes`).
+        '''
+        data = decode_content_data(request) or {}
+        try:
+            return self.parent.get_routes(step_number=data.get('step_number'),
+                                          encoding=data.get('encoding'),
+                                          if_version=data.get('if_version'))
+        except Exception:
+            _L().error(str(data), exc_info=True)
+
+    def on_execute__add_routes(self, request):
+        '''
+        .. versionadded:: 2.6
+        '''
+        data = decode_content_data(request)
+        try:
+            return self.parent.add_routes(data['drop_routes'],
+                                          return_routes=data
+                                          .get('return_routes', True))
+        except Exception:
+            _L().error(str(data), exc_info=True)
 
     def on_execute__clear_routes(self, request):
+        '''
+        .. versionchanged:: 2.6
+            Accept optional list of electrodes (i.e., ``electrode_ids``).
+        '''
         data = decode_content_data(request)
         try:
             return self.parent.clear_routes(electrode_id=data
-                                            .get('electrode_id'))
+                                            .get('electrode_id'),
+                                            electrode_ids=data
+                                            .get('electrode_ids'))
+        except Exception:
+            _L().error(str(data), exc_info=True)
+
+    def on_execute__add_route_between(self, request):
+        '''
+        .. versionadded:: 2.6
+        '''
+        data = decode_content_data(request)
+        try:
+            return self.parent.add_route_between(data['source'],
+                                                 data['target'])
+        except Exception:
+            _L().error(str(data), exc_info=True)
+
+    def on_execute__plan_routes(self, request):
+        '''
+        .. versionadded:: 2.6
+        '''
+        data = decode_content_data(request)
+        try:
+            return self.parent.plan_step_routes(data['pairs'])
+        except Exception:
+            _L().error(str(data), exc_info=True)
+
+    def on_execute__seek_frame(self, request):
+        '''
+        .. versionadded:: 2.6
+        '''
+        data = decode_content_data(request)
+        try:
+            return self.parent.seek_frame(data['frame'])
+        except Exception:
+            _L().error(str(data), exc_info=True)
+
+    def on_execute__tell_frame(self, request):
+        '''
+        .. versionadded:: 2.6
+        '''
+        data = decode_content_data(request)
+        try:
+            return self.parent.tell_frame()
+        except Exception:
+            _L().error(str(data), exc_info=True)
+
+    def on_execute__route_changes(self, request):
+        '''
+        Echo route changes, such that they are published to all subscribers
+        of the hub in the reply (see
+        :meth:`DropletPlanningPlugin.set_routes`).
+
+        .. versionadded:: 2.6
+        '''
+        return decode_content_data(request)
+
+    def on_execute__set_electrode_adjacency(self, request):
+        '''
+        .. versionadded:: 2.6
+        '''
+        data = decode_content_data(request)
+        try:
+            return self.parent.set_electrode_adjacency(data['adjacency'])
+        except Exception:
+            _L().error(str(data), exc_info=True)
+
+    def on_execute__set_electrode_channels(self, request):
+        '''
+        .. versionadded:: 2.6
+        '''
+        data = decode_content_data(request)
+        try:
+            return self.parent.set_electrode_channels(data['channels'])
+        except Exception:
+            _L().error(str(data), exc_info=True)
+
+    def on_execute__set_states_mode(self, request):
+        '''
+        .. versionadded:: 2.6
+        '''
+        data = decode_content_data(request)
+        try:
+            return self.parent.set_states_mode(data['mode'])
         except Exception:
             _L().error(str(data), exc_info=True)
 
@@ -74,8 +453,11 @@ class RouteController(object):
 
     @staticmethod
     def default_routes():
-        return pd.DataFrame(None, columns=['route_i', 'electrode_i',
-                                           'transition_i'], dtype='int32')
+        '''
+        .. versionchanged:: 2.6
+            Return empty :class:`routes.RouteTable`.
+        '''
+        return RouteTable()
 
 
 class DropletPlanningPlugin(Plugin, StepOptionsController):
@@ -124,8 +506,27 @@ class DropletPlanningPlugin(Plugin, StepOptionsController):
         self.name = self.plugin_name
         self._electrode_states = iter([])
         self.plugin = None
-        self.executor = ThreadPoolExecutor(max_workers=1)
-        self._plugin_monitor_task = None
+        # Compiled schedules, reused when returning to a step with the same
+        # routes and options.
+        self.schedule_cache = ScheduleCache()
+        # Compile schedules of all protocol steps in the background.
+        self.precompiler = SchedulePrecompiler(self.schedule_cache)
+        # Step to prefetch once the current step starts executing, and
+        # `(step_number, schedule key)` of prefetched step.
+        self._prefetch_step = None
+        self._prefetched = None
+        # Output mode of `get_electrode_states_request()` (see
+        # `states.STATES_MODES`).
+        self.states_mode = 'series'
+        # Adjacency graph of device electrodes, used to plan routes (see
+        # `set_electrode_adjacency()`).
+        self.electrode_graph = None
+        # Electrode to channel mapping of device, used by the "channels"
+        # states mode (see `set_electrode_channels()`).
+        self.channel_map = None
+        # Version of route table last broadcast on step swap (see
+        # `on_step_swapped()`).
+        self._routes_version = None
 
     def get_schedule_requests(self, function_name):
         """
@@ -147,11 +548,15 @@ class DropletPlanningPlugin(Plugin, StepOptionsController):
             - Use `zmq_plugin.plugin.watch_plugin()` to monitor ZeroMQ
               interface in background thread.
             - Register `clear_routes` commands with ``microdrop.command_plugin``.
+
+        .. versionchanged:: 2.6
+            Monitor ZeroMQ interface on a dedicated command loop thread (see
+            :meth:`RouteControllerZmqPlugin.start`), which blocks until
+            commands arrive rather than polling.
         '''
         self.cleanup()
         self.plugin = RouteControllerZmqPlugin(self, self.name, get_hub_uri())
-
-        self._plugin_monitor_task = watch_plugin(self.executor, self.plugin)
+        self.plugin.start()
 
         hub_execute_async('microdrop.command_plugin', 'register_command',
                           command_name='clear_routes', namespace='global',
@@ -174,14 +579,50 @@ class DropletPlanningPlugin(Plugin, StepOptionsController):
         self.cleanup()
 
     def cleanup(self):
+        '''
+        .. versionchanged:: 2.6
+            - Stop background schedule compilation.
+            - Stop command loop thread and close ZeroMQ sockets.
+        '''
         if self.plugin is not None:
+            self.plugin.stop()
             self.plugin = None
-        if self._plugin_monitor_task is not None:
-            self._plugin_monitor_task.cancel()
+        self.precompiler.shutdown()
+
+    ###########################################################################
+    # Protocol event handler methods
+    def on_protocol_swapped(self, old_protocol, protocol):
+        '''
+        Handler called when a different protocol is loaded.
+
+        .. versionadded:: 2.6
+            Compile schedules of all steps in the background.
+        '''
+        self._prefetched = None
+        self._routes_version = None
+        self.precompile_protocol()
+
+    def on_protocol_changed(self):
+        '''
+        Handler called when the protocol is modified.
+
+        .. versionadded:: 2.6
+            Cancel pending compilation and compile schedules of modified steps
+            in the background.
+        '''
+        self.precompile_protocol()
 
     ###########################################################################
     # Step event handler methods
     def get_electrode_states_request(self):
+        '''
+        .. versionchanged:: 2.6
+            Compile schedule of the next step in the background once the
+            current step starts executing.
+        '''
+        if self._prefetch_step is not None:
+            step_number, self._prefetch_step = self._prefetch_step, None
+            self.prefetch_step(step_number)
         try:
             return self._electrode_states.next()
         except StopIteration:
@@ -206,81 +647,678 @@ class DropletPlanningPlugin(Plugin, StepOptionsController):
     def on_step_swapped(self, old_step_number, step_number):
         """
         Handler called when the current step is swapped.
+
+        .. versionchanged:: 2.6
+            Only broadcast routes of new step if they differ from the routes
+            last broadcast, e.g., not when swapping between copies of a step.
         """
         self.reset_electrode_states_generator()
 
         if self.plugin is not None:
-            self.plugin.execute_async(self.name, 'get_routes')
+            version = self.get_route_table().version
+            if version != self._routes_version:
+                self._routes_version = version
+                self.plugin.execute_async(self.name, 'get_routes')
+
+    def on_step_options_changed(self, plugin, step_number):
+        '''
+        Handler called when the step options are changed for a particular
+        plugin.
+
+        .. versionadded:: 2.6
+            Discard prefetched schedule of modified step.
+        '''
+        if plugin != self.name:
+            return
+        if (self._prefetched is not None and
+                self._prefetched[0] == step_number):
+            self._prefetched = None
+        # Routes may have been modified (and broadcast in a command reply)
+        # since routes were last broadcast on step swap.
+        self._routes_version = None
 
     def on_step_inserted(self, step_number, *args):
+        '''
+        .. versionchanged:: 2.6
+            Discard prefetched schedule since step numbers have changed.
+        '''
+        self._prefetched = None
         self.clear_routes(step_number=step_number)
         self._electrode_states = iter([])
 
+    def on_step_removed(self, step_number, step):
+        '''
+        .. versionadded:: 2.6
+            Discard prefetched schedule since step numbers have changed.
+        '''
+        self._prefetched = None
+
     ###########################################################################
     # Step options dependent methods
-    def add_route(self, electrode_ids):
+    def add_route(self, electrode_ids, return_routes=True):
         '''
         Add droplet route.
 
+        .. versionchanged:: 2.6
+            Append route in place to :class:`routes.RouteTable` of step,
+            i.e., in amortized ``O(route length)`` time.  Set
+            :data:`return_routes` to ``False`` to skip building the route
+            table included in the result.
+
         Args:
 
             electrode_ids (list) : Ordered list of identifiers of electrodes on
                 route.
+            return_routes (bool) : Include route table of step in result.
         '''
-        drop_routes = self.get_routes()
-        route_i = (drop_routes.route_i.max() + 1
-                   if drop_routes.shape[0] > 0 else 0)
-        drop_route = (pd.DataFrame(electrode_ids, columns=['electrode_i'])
-                      .reset_index().rename(columns={'index': 'transition_i'}))
-        drop_route.insert(0, 'route_i', route_i)
-        drop_routes = drop_routes.append(drop_route, ignore_index=True)
-        self.set_routes(drop_routes)
-        return {'route_i': route_i, 'drop_routes': drop_routes}
+        drop_routes = self.get_route_table()
+        previous_version = drop_routes.version
+        start = len(drop_routes)
+        route_i = drop_routes.append_route(electrode_ids)
+        self._write_routes(drop_routes, previous_version=previous_version,
+                           added=[route_i],
+                           added_rows=slice(start, len(drop_routes)))
+        result = {'route_i': route_i}
+        if return_routes:
+            result['drop_routes'] = drop_routes.to_frame()
+        return result
+
+    def add_routes(self, drop_routes, return_routes=True):
+        '''
+        Add several droplet routes at once, with a single write of the step
+        options.
+
+        .. versionadded:: 2.6
 
-    def clear_routes(self, electrode_id=None, step_number=None):
+        Parameters
+        ----------
+        drop_routes : list or bytes
+            Ordered list of identifiers of electrodes on each route, or route
+            table in columnar encoding (see
+            :meth:`routes.RouteTable.to_columnar`).  Identifiers and start
+            offsets of encoded routes are *not* preserved.
+        return_routes : bool, optional
+            Include route table of step in result.
+
+        Returns
+        -------
+        dict
+            Identifier of each added route (i.e., ``route_i``) and, if
+            :data:`return_routes` is ``True``, the route table of the step
+            (i.e., ``drop_routes``).
+
+        Raises
+        ------
+        ValueError
+            If any route is empty, in which case no route is added.
+        '''
+        if isinstance(drop_routes, bytes):
+            drop_routes = RouteTable.from_columnar(drop_routes)\
+                .route_electrodes()
+        drop_routes = [list(electrode_ids) for electrode_ids in drop_routes]
+        if not all(drop_routes):
+            raise ValueError('Routes must include at least one electrode.')
+        route_table = self.get_route_table()
+        previous_version = route_table.version
+        start = len(route_table)
+        route_ids = [route_table.append_route(electrode_ids)
+                     for electrode_ids in drop_routes]
+        self._write_routes(route_table, previous_version=previous_version,
+                           added=route_ids,
+                           added_rows=slice(start, len(route_table)))
+        result = {'route_i': route_ids}
+        if return_routes:
+            result['drop_routes'] = route_table.to_frame()
+        return result
+
+    def add_route_between(self, source, target):
+        '''
+        Plan shortest droplet route between two electrodes and add it to the
+        current step.
+
+        .. versionadded:: 2.6
+
+        Parameters
+        ----------
+        source, target : str
+            Identifiers of first and last electrodes on route.
+
+        Returns
+        -------
+        dict
+            Result of :meth:`add_route`, along with the planned route (i.e.,
+            ``drop_route``).
+
+        Raises
+        ------
+        ValueError
+            If no route exists between the electrodes.
+        '''
+        drop_route = self.plan_route(source, target)
+        result = self.add_route(drop_route)
+        result['drop_route'] = drop_route
+        return result
+
+    def check_route_conflicts(self, step_number=None):
+        '''
+        Find frames where droplets of different routes of the step are on the
+        same electrode or, if the electrode adjacency is set (see
+        :meth:`set_electrode_adjacency`), on adjacent electrodes.
+
+        .. versionadded:: 2.6
+
+        Returns
+        -------
+        pandas.DataFrame
+            Conflicting ``(frame, route_a, route_b)`` rows (see
+            :func:`planning.route_conflicts`).
+        '''
+        step_options = self.get_step_options(step_number=step_number)
+        return route_conflicts(self.get_route_table(step_number),
+                               trail_length=step_options['trail_length'],
+                               graph=self.electrode_graph)
+
+    def clear_routes(self, electrode_id=None, step_number=None,
+                     electrode_ids=None):
         '''
         Clear all drop routes for protocol step that include the specified
         electrode (identified by string identifier).
+
+        .. versionchanged:: 2.6
+            - Look up routes that include electrode in the inverted index of
+              the route table (see
+              :meth:`routes.RouteTable.electrode_routes`) and remove them in
+              place.
+            - Accept list of electrodes (i.e., :data:`electrode_ids`), and
+              remove routes including any of them with a single write of
+              the step options.
+            - Return identifiers of removed routes.
+
+        Returns
+        -------
+        list
+            Sorted identifiers of removed routes.
         '''
-        step_options = self.get_step_options(step_number)
+        if electrode_ids is not None:
+            electrode_ids = list(electrode_ids)
+            if electrode_id is not None:
+                electrode_ids.append(electrode_id)
+        elif electrode_id is not None:
+            electrode_ids = [electrode_id]
 
-        if electrode_id is None:
+        if electrode_ids is None:
             # No electrode identifier specified.  Clear all step routes.
-            df_routes = RouteController.default_routes()
+            route_ids = self.get_route_table(step_number).route_ids().tolist()
+            drop_routes = RouteController.default_routes()
         else:
-            df_routes = step_options['drop_routes']
-            # Find indexes of all routes that include electrode.
-            routes_to_clear = df_routes.loc[df_routes.electrode_i ==
-                                            electrode_id, 'route_i']
-            # Remove all routes that include electrode.
-            df_routes = df_routes.loc[~df_routes.route_i
-                                      .isin(routes_to_clear.tolist())].copy()
-        step_options['drop_routes'] = df_routes
-        self.set_step_values(step_options, step_number=step_number)
+            drop_routes = self.get_route_table(step_number)
+            # Remove all routes that include electrodes (in place).
+            route_ids = sorted(set().union(*[drop_routes
+                                             .routes_with_electrode(e)
+                                             .tolist()
+                                             for e in electrode_ids]))
+            if not route_ids:
+                return route_ids
+            previous_version = drop_routes.version
+            drop_routes.remove_routes(route_ids)
+            self._write_routes(drop_routes, step_number=step_number,
+                               previous_version=previous_version,
+                               removed=route_ids)
+            return route_ids
+        self.set_routes(drop_routes, step_number=step_number)
+        return route_ids
 
-    def get_routes(self, step_number=None):
+    def compact_routes(self, step_number=None):
+        '''
+        Delay the start of routes so that independent routes overlap, while
+        conflicting routes run one after the other (see
+        :func:`planning.route_offsets`).
+
+        Routes conflict if they share electrodes, or adjacent electrodes if
+        the electrode adjacency is set (see :meth:`set_electrode_adjacency`).
+
+        .. versionadded:: 2.6
+
+        Returns
+        -------
+        dict
+            Route table (i.e., ``drop_routes``), and number of frames in the
+            first pass through all routes (i.e., ``frames``).
+        '''
+        drop_routes = self.get_route_table(step_number).copy()
+        drop_routes.set_start_offsets(route_offsets(drop_routes,
+                                                    self.electrode_graph))
+        self.set_routes(drop_routes, step_number=step_number)
+        frames = 0
+        if len(drop_routes):
+            frames = int((drop_routes.start_offset +
+                          drop_routes.transition_i).max()) + 1
+        return {'drop_routes': drop_routes.to_frame(), 'frames': frames}
+
+    def get_electrode_routes(self, electrode_id, step_number=None):
+        '''
+        .. versionadded:: 2.6
+
+        Returns
+        -------
+        list
+            Sorted identifiers of routes of step that include the specified
+            electrode.
+        '''
+        return (self.get_route_table(step_number)
+                .routes_with_electrode(electrode_id).tolist())
+
+    def get_routes(self, step_number=None, encoding=None, if_version=None):
+        '''
+        .. versionchanged:: 2.6
+            - Return :class:`pandas.DataFrame` view of route table (see
+              :meth:`get_route_table`).
+            - Add :data:`encoding` and :data:`if_version` arguments.
+
+        Parameters
+        ----------
+        step_number : int, optional
+            Step number (default: current step).
+        encoding : str, optional
+            If ``'columnar'``, return route table in columnar encoding (see
+            :meth:`routes.RouteTable.to_columnar`), which is much cheaper to
+            serialize than a :class:`pandas.DataFrame`.
+        if_version : int, optional
+            Version of route table held by caller (see
+            :attr:`routes.RouteTable.version`).  If specified, return a
+            ``dict`` with the current ``version`` of the route table and
+            ``not_modified``, i.e., whether the route table is still at
+            :data:`if_version`.  The route table itself (i.e.,
+            ``drop_routes``) is only included if modified.  Pass, e.g., ``0``
+            to get the route table along with its version.
+
+        Returns
+        -------
+        pandas.DataFrame or bytes or dict
+            Route table of step, or ``dict`` if :data:`if_version` is
+            specified.
+        '''
+        route_table = self.get_route_table(step_number=step_number)
+        if if_version is not None and if_version == route_table.version:
+            return {'version': route_table.version, 'not_modified': True}
+        if encoding is None:
+            drop_routes = route_table.to_frame()
+        elif encoding == 'columnar':
+            drop_routes = route_table.to_columnar()
+        else:
+            raise ValueError('Unsupported route table encoding: %s' %
+                             encoding)
+        if if_version is None:
+            return drop_routes
+        return {'version': route_table.version, 'not_modified': False,
+                'drop_routes': drop_routes}
+
+    def get_route_table(self, step_number=None):
+        '''
+        .. versionadded:: 2.6
+
+        Returns
+        -------
+        routes.RouteTable
+            Route table of step.
+        '''
         step_options = self.get_step_options(step_number=step_number)
-        return step_options.get('drop_routes',
-                                RouteController.default_routes())
+        drop_routes = step_options.get('drop_routes')
+        if not isinstance(drop_routes, RouteTable):
+            # Convert route table of protocol saved with previous version.
+            drop_routes = as_route_table(drop_routes)
+            step_options['drop_routes'] = drop_routes
+        return drop_routes
 
     def set_routes(self, df_routes, step_number=None):
+        '''
+        .. versionchanged:: 2.6
+            - Accept :class:`pandas.DataFrame` or :class:`routes.RouteTable`.
+            - Publish added and removed routes on the hub, as the reply to
+              a ``route_changes`` command, so that subscribers can keep a
+              mirror of the routes up to date without fetching the route
+              table.  The published ``dict`` contains:
+
+              - ``step_number``: step of modified routes.
+              - ``version``: new version of the route table (see
+                :attr:`routes.RouteTable.version`).
+              - ``previous_version``: version the changes apply to, or
+                ``None`` if unknown.
+              - ``reset``: if ``True``, changes are unknown (e.g., a route
+                table modified in place was set) and ``added`` contains
+                *all* routes, i.e., mirrors must be replaced.
+              - ``added``: table of added routes (see :meth:`get_routes`).
+              - ``removed``: identifiers of removed routes.
+
+              A modified route is both removed and added.
+        '''
+        previous = self.get_route_table(step_number=step_number)
+        drop_routes = as_route_table(df_routes)
+        if self.plugin is None or drop_routes is previous:
+            self._write_routes(drop_routes, step_number=step_number)
+        else:
+            added, removed = route_changes(previous, drop_routes)
+            self._write_routes(drop_routes, step_number=step_number,
+                               previous_version=previous.version,
+                               added=added, removed=removed)
+
+    def _write_routes(self, drop_routes, step_number=None,
+                      previous_version=None, added=None, removed=None,
+                      added_rows=None):
+        '''
+        Write route table to step options and publish route changes (see
+        :meth:`set_routes`).
+
+        If :data:`previous_version` is ``None``, all routes are published.
+        If :data:`added_rows` is specified (i.e., the range of rows of routes
+        appended in place), only those rows are published as added routes,
+        without copying the route table.
+        '''
         step_options = self.get_step_options(step_number=step_number)
-        step_options['drop_routes'] = df_routes
+        step_options['drop_routes'] = drop_routes
         self.set_step_values(step_options, step_number=step_number)
+        if self.plugin is None:
+            return
+
+        if step_number is None:
+            step_number = get_app().protocol.current_step_number
+        reset = previous_version is None
+        if reset:
+            df_added = drop_routes.to_frame()
+            removed = []
+        elif added_rows is not None:
+            df_added = drop_routes.to_frame(rows=added_rows)
+        else:
+            df_added = drop_routes.subset(added or []).to_frame()
+        self.plugin.execute_async(self.name, 'route_changes',
+                                  step_number=step_number,
+                                  version=drop_routes.version,
+                                  previous_version=previous_version,
+                                  reset=reset, added=df_added,
+                                  removed=list(removed or []))
 
     def reset_electrode_states_generator(self):
         '''
         Reset iterator over actuation states of electrodes in routes table.
+
+        .. versionchanged:: 2.6
+            Reuse compiled schedule from :attr:`schedule_cache` if routes and
+            trail length are unchanged, or from background compilation (see
+            :meth:`precompile_protocol` and :meth:`prefetch_step`).
         '''
-        df_routes = self.get_routes()
+        step_number = get_app().protocol.current_step_number
         step_options = self.get_step_options()
-        _L().debug('df_routes=%s\nstep_options=%s', df_routes, step_options)
+        schedule = None
+        key = None
+        if self._prefetched is not None and self._prefetched[0] == step_number:
+            # Schedule of step was prefetched while previous step executed.
+            key = self._prefetched[1]
+            schedule = self.precompiler.result(key)
+        self._prefetched = None
+        if schedule is None:
+            df_routes = self.get_route_table()
+            _L().debug('df_routes=%s\nstep_options=%s', df_routes,
+                       step_options)
+            key = schedule_key(df_routes,
+                               trail_length=step_options['trail_length'])
+            schedule = self.precompiler\
+                .compile(df_routes, trail_length=step_options['trail_length'])
+        self._prefetch_step = step_number + 1
+        if self.states_mode == 'channels':
+            schedule = self.schedule_cache.channel_schedule(key, schedule,
+                                                            self.channel_map)
         self._electrode_states = \
-            electrode_states(df_routes,
-                             trail_length=step_options['trail_length'],
-                             repeats=step_options['route_repeats'],
-                             repeat_duration_s=step_options
-                             ['repeat_duration_s'])
+            STATES_MODES[self.states_mode](schedule,
+                                           repeats=step_options
+                                           ['route_repeats'],
+                                           repeat_duration_s=step_options
+                                           ['repeat_duration_s'])
+
+    def seek_frame(self, frame):
+        '''
+        Move electrode states of current step to frame, e.g., to resume a
+        step where it was paused.
+
+        .. versionadded:: 2.6
+
+        Parameters
+        ----------
+        frame : int
+            Index of next frame (see :class:`states.StatesCursor`).
+
+        Returns
+        -------
+        dict
+            Position after seek (see :meth:`tell_frame`).
+
+        Raises
+        ------
+        ValueError
+            If the output mode does not support seeking (i.e., ``"runs"``).
+        IndexError
+            If :data:`frame` is out of range (see
+            :meth:`states.StatesCursor.seek`).
+        '''
+        self._states_cursor().seek(frame)
+        return self.tell_frame()
+
+    def tell_frame(self):
+        '''
+        .. versionadded:: 2.6
+
+        Returns
+        -------
+        dict
+            Index of next frame (i.e., ``frame``), number of frames planned
+            so far (i.e., ``frames``) and number of planned frames after the
+            next frame (i.e., ``remaining``).
+        '''
+        cursor = self._states_cursor()
+        return {'frame': cursor.tell(), 'frames': cursor.frames,
+                'remaining': cursor.remaining()}
+
+    def _states_cursor(self):
+        if not isinstance(self._electrode_states, StatesCursor):
+            raise ValueError('Electrode states of mode `%s` do not support '
+                             'seeking.' % self.states_mode)
+        return self._electrode_states
+
+    def prefetch_step(self, step_number):
+        '''
+        Compile schedule of step in the background, e.g., while the previous
+        step is executing.
+
+        The prefetched schedule is picked up when the step is swapped in, and
+        is discarded if the options of the step are changed beforehand.
+
+        .. versionadded:: 2.6
+        '''
+        app = get_app()
+        if app.protocol is None or not (0 <= step_number <
+                                        len(app.protocol.steps)):
+            return
+        drop_routes = self.get_route_table(step_number=step_number)
+        if len(drop_routes) < 1:
+            return
+        step_options = self.get_step_options(step_number=step_number)
+        key = self.precompiler.submit(drop_routes, trail_length=step_options
+                                      ['trail_length'])
+        self._prefetched = step_number, key
+
+    def precompile_protocol(self):
+        '''
+        Compile schedules of all protocol steps in the background.
+
+        Pending compilations are cancelled.  Schedules of steps with
+        unchanged routes and trail length are already cached and are not
+        compiled again.
+
+        .. versionadded:: 2.6
+        '''
+        app = get_app()
+        if app.protocol is None:
+            return
+        items = []
+        for step_number in xrange(len(app.protocol.steps)):
+            drop_routes = self.get_route_table(step_number=step_number)
+            if len(drop_routes) > 0:
+                step_options = self.get_step_options(step_number=step_number)
+                items.append((drop_routes, step_options['trail_length']))
+        self.precompiler.submit_all(items)
+
+    def set_electrode_adjacency(self, adjacency):
+        '''
+        Set electrode adjacency graph of device, used to plan routes.
+
+        All-pairs shortest paths of the graph are loaded from
+        :data:`PATH_INDEX_DIR`, or computed and stored there the first time
+        the adjacency of a device is set.
+
+        .. versionadded:: 2.6
+
+        Parameters
+        ----------
+        adjacency : dict or pandas.DataFrame or list
+            Electrode adjacency (see :class:`planning.ElectrodeGraph`).
+
+        Returns
+        -------
+        int
+            Number of electrodes in graph.
+        '''
+        graph = ElectrodeGraph(adjacency)
+        graph.path_index = PathIndex.cached(graph, PATH_INDEX_DIR)
+        self.electrode_graph = graph
+        return len(self.electrode_graph)
+
+    def plan_route(self, source, target):
+        '''
+        .. versionadded:: 2.6
+
+        Returns
+        -------
+        list
+            Identifiers of electrodes along a shortest route from
+            :data:`source` to :data:`target` (inclusive).
+
+        Raises
+        ------
+        ValueError
+            If electrode adjacency is not set, or no route exists between the
+            electrodes.
+        '''
+        if self.electrode_graph is None:
+            raise ValueError('Electrode adjacency is not set.')
+        drop_route = self.electrode_graph.shortest_path(source, target)
+        if drop_route is None:
+            raise ValueError('No route from `%s` to `%s`.' % (source, target))
+        return drop_route
+
+    def plan_step_routes(self, pairs, step_number=None):
+        '''
+        Plan conflict-free routes for several droplets moving at once, and
+        replace the routes of the step with them.
+
+        Existing routes of the step are replaced, since planned routes only
+        avoid each other.
+
+        .. versionadded:: 2.6
+
+        Parameters
+        ----------
+        pairs : list
+            ``(source, target)`` electrode identifiers of each droplet.
+
+        Returns
+        -------
+        dict
+            Planned route table (i.e., ``drop_routes``), and number of
+            frames until all droplets arrive (i.e., ``frames``).
+
+        Raises
+        ------
+        ValueError
+            If electrode adjacency is not set, the trail length of the step
+            is not 1 (planned routes only avoid each other with a single
+            electrode per droplet), or routes cannot be planned (see
+            :func:`planning.plan_routes`).
+        '''
+        if self.electrode_graph is None:
+            raise ValueError('Electrode adjacency is not set.')
+        step_options = self.get_step_options(step_number=step_number)
+        if step_options['trail_length'] != 1:
+            raise ValueError('Routes can only be planned for steps with a '
+                             'trail length of 1 (trail length is %s).' %
+                             step_options['trail_length'])
+        drop_routes = RouteTable()
+        frames = 0
+        for drop_route in plan_routes(self.electrode_graph, pairs):
+            if len(drop_route) > 1:
+                # Droplets that do not move need no route.
+                drop_routes.append_route(drop_route)
+            frames = max(frames, len(drop_route))
+        self.set_routes(drop_routes, step_number=step_number)
+        return {'drop_routes': drop_routes.to_frame(), 'frames': frames}
+
+    def set_electrode_channels(self, channels):
+        '''
+        Set electrode to channel mapping of device, used by the
+        ``"channels"`` states mode (see :meth:`set_states_mode`).
+
+        .. versionadded:: 2.6
+
+        Parameters
+        ----------
+        channels : dict or pandas.Series or pandas.DataFrame or list
+            Electrode to channel mapping (see :class:`schedule.ChannelMap`).
+
+        Returns
+        -------
+        int
+            Number of ``(electrode, channel)`` mappings.
+        '''
+        self.channel_map = ChannelMap(channels)
+        return len(self.channel_map)
+
+    def set_states_mode(self, mode):
+        '''
+        Set output mode of :meth:`get_electrode_states_request`.
+
+        Takes effect the next time the electrode states generator is reset,
+        e.g., when a step is swapped.
+
+        .. versionadded:: 2.6
+
+        Parameters
+        ----------
+        mode : str
+            One of the keys of :data:`states.STATES_MODES`, e.g.:
+
+             - ``"series"``: states of all electrodes on routes (default).
+             - ``"delta"``: states of electrodes which changed since the
+               previous frame, after an initial full keyframe.
+             - ``"runs"``: :class:`states.StateRun` records of states held
+               for several frames, and :class:`states.StateLoop` records of
+               repeated passes through cyclic routes.
+             - ``"packed"``: :class:`schedule.PackedStates` bit arrays of
+               states of all electrodes on routes.
+             - ``"channels"``: states of all channels of electrodes on
+               routes, where a channel is on if *any* of its electrodes is
+               on (requires electrode channels, see
+               :meth:`set_electrode_channels`).
+
+        Returns
+        -------
+        str
+            Previous output mode.
+        '''
+        if mode not in STATES_MODES:
+            raise ValueError('Unsupported mode: `%s`.  Must be one of: %s' %
+                             (mode, ', '.join(STATES_MODES)))
+        elif mode == 'channels' and self.channel_map is None:
+            raise ValueError('Electrode channels are not set.')
+        previous_mode, self.states_mode = self.states_mode, mode
+        return previous_mode
 
 
 PluginGlobals.pop_env()
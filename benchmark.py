@@ -0,0 +1,287 @@
+'''
+Benchmark :func:`states.electrode_states` across route count, route length
+and trail length.
+
+Run as a module, e.g.::
+
+    python -m droplet_planning_plugin.benchmark --output results.json
+
+Results are written as JSON so that runs may be compared.
+
+.. versionadded:: 2.6
+'''
+from __future__ import absolute_import, division, print_function
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import datetime as dt
+import gc
+import itertools as it
+import json
+import platform
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from .states import electrode_states
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2.
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    # Windows.
+    resource = None
+
+ROUTE_COUNTS = (1, 10, 100, 500)
+ROUTE_LENGTHS = (2, 20, 200)
+TRAIL_LENGTHS = (1, 2, 3, 4, 5)
+
+
+def synthetic_routes(route_count, route_length, cyclic=False, grid=(32, 32),
+                     seed=0):
+    '''
+    Generate a table of random-walk routes on a grid of electrodes.
+
+    Parameters
+    ----------
+    route_count : int
+        Number of routes.
+    route_length : int
+        Number of transitions in each route.
+    cyclic : bool, optional
+        If ``True``, the last electrode of each route matches the first.
+    grid : tuple, optional
+        Number of ``(rows, columns)`` of electrodes.
+    seed : int, optional
+        Random seed.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Table of route transitions with the columns ``route_i``,
+        ``electrode_i`` and ``transition_i``.
+    '''
+    random = np.random.RandomState(seed)
+    steps = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)])
+    start = np.column_stack([random.randint(0, n, size=route_count)
+                             for n in grid])
+    moves = steps[random.randint(0, 4, size=(route_count, route_length))]
+    moves[:, 0] = 0
+    positions = (start[:, np.newaxis] + moves.cumsum(axis=1)) % grid
+    if cyclic and route_length > 1:
+        positions[:, -1] = positions[:, 0]
+    electrode_ids = np.array(['electrode%03d' % i
+                              for i in xrange(grid[0] * grid[1])],
+                             dtype=object)
+    codes = positions[..., 0] * grid[1] + positions[..., 1]
+    return pd.DataFrame({'route_i': np.repeat(np.arange(route_count,
+                                                        dtype='int32'),
+                                              route_length),
+                         'electrode_i': electrode_ids[codes.ravel()],
+                         'transition_i': np.tile(np.arange(route_length,
+                                                           dtype='int32'),
+                                                 route_count)},
+                        columns=['route_i', 'electrode_i', 'transition_i'])
+
+
+def run_case(df_routes, trail_length=1, repeats=1):
+    '''
+    Run :func:`states.electrode_states` to exhaustion.
+
+    Memory is measured in a separate, untimed pass (see
+    :func:`measure_memory`), so tracing allocations does not slow down the
+    timed pass.
+
+    Returns
+    -------
+    dict
+        Number of ``frames``, ``first_frame_s`` (time to first frame,
+        including compilation), ``total_s``, ``frames_per_s``, and memory
+        usage (see :func:`measure_memory`).
+    '''
+    gc.collect()
+    start = timeit.default_timer()
+    states = electrode_states(df_routes, trail_length=trail_length,
+                              repeats=repeats)
+    frames = 0
+    first_frame_s = None
+    for frames, _ in enumerate(states, 1):
+        if first_frame_s is None:
+            first_frame_s = timeit.default_timer() - start
+    total_s = timeit.default_timer() - start
+    result = {'frames': frames, 'first_frame_s': first_frame_s,
+              'total_s': total_s,
+              'frames_per_s': frames / total_s if total_s > 0 else None}
+    result.update(measure_memory(df_routes, trail_length=trail_length,
+                                 repeats=repeats))
+    return result
+
+
+def _exhaust(df_routes, trail_length, repeats):
+    for _ in electrode_states(df_routes, trail_length=trail_length,
+                              repeats=repeats):
+        pass
+
+
+def peak_rss():
+    '''
+    Returns
+    -------
+    int or None
+        Peak resident set size (i.e., peak working set on Windows) of the
+        current process in bytes, or ``None`` if not available.
+    '''
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes, except on macOS.
+        return max_rss if sys.platform == 'darwin' else 1024 * max_rss
+    elif sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = ([('cb', wintypes.DWORD),
+                         ('PageFaultCount', wintypes.DWORD)] +
+                        [(name, ctypes.c_size_t) for name in
+                         ('PeakWorkingSetSize', 'WorkingSetSize',
+                          'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                          'QuotaPeakNonPagedPoolUsage',
+                          'QuotaNonPagedPoolUsage', 'PagefileUsage',
+                          'PeakPagefileUsage')])
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+        get_current_process.restype = wintypes.HANDLE
+        if ctypes.windll.psapi.GetProcessMemoryInfo(get_current_process(),
+                                                    ctypes.byref(counters),
+                                                    counters.cb):
+            return counters.PeakWorkingSetSize
+    return None
+
+
+def _worker_peak_rss(df_routes, trail_length, repeats):
+    _exhaust(df_routes, trail_length, repeats)
+    return peak_rss()
+
+
+def measure_memory(df_routes, trail_length=1, repeats=1):
+    '''
+    Run :func:`states.electrode_states` to exhaustion (untimed) and measure
+    memory usage.
+
+    Returns
+    -------
+    dict
+        Either ``peak_bytes``, i.e., peak memory allocated while running
+        (using :mod:`tracemalloc`), or, if :mod:`tracemalloc` is not
+        available (e.g., on Python 2), ``peak_rss_bytes``, i.e., peak
+        resident set size of a fresh worker process running the case (see
+        :func:`peak_rss`).  The other value is ``None``.
+
+    Raises
+    ------
+    RuntimeError
+        If memory usage cannot be measured on this platform.
+    '''
+    peak_bytes = None
+    peak_rss_bytes = None
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            _exhaust(df_routes, trail_length, repeats)
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    else:
+        # Python 2 has no allocation tracing, and the resident set size of
+        # this process only ever grows, so run the case in a new process.
+        executor = ProcessPoolExecutor(max_workers=1)
+        try:
+            peak_rss_bytes = executor.submit(_worker_peak_rss, df_routes,
+                                             trail_length, repeats).result()
+        finally:
+            executor.shutdown()
+        if peak_rss_bytes is None:
+            raise RuntimeError('Peak memory cannot be measured on this '
+                               'platform.')
+    return {'peak_bytes': peak_bytes, 'peak_rss_bytes': peak_rss_bytes}
+
+
+def run(route_counts=ROUTE_COUNTS, route_lengths=ROUTE_LENGTHS,
+        trail_lengths=TRAIL_LENGTHS, cyclic=(False, True), repeats=1,
+        seed=0, log=None):
+    '''
+    Run benchmark over grid of parameters.
+
+    Returns
+    -------
+    list
+        One record (see :func:`run_case`) per combination of parameters.
+    '''
+    results = []
+    for route_count, route_length, cyclic_i in it.product(route_counts,
+                                                          route_lengths,
+                                                          cyclic):
+        df_routes = synthetic_routes(route_count, route_length,
+                                     cyclic=cyclic_i, seed=seed)
+        for trail_length in trail_lengths:
+            result = {'route_count': route_count,
+                      'route_length': route_length, 'cyclic': cyclic_i,
+                      'trail_length': trail_length, 'repeats': repeats}
+            result.update(run_case(df_routes, trail_length=trail_length,
+                                   repeats=repeats))
+            results.append(result)
+            if log is not None:
+                print('routes=%(route_count)4d length=%(route_length)4d '
+                      'cyclic=%(cyclic)-5s trail=%(trail_length)d: '
+                      '%(frames)6d frames, first frame %(first_frame_s).4fs, '
+                      '%(frames_per_s)10.1f frames/s' % result, file=log)
+    return results
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip()
+                                     .splitlines()[0])
+    parser.add_argument('-o', '--output', help='Output JSON file (default: '
+                        '`electrode_states-<timestamp>.json`).')
+    parser.add_argument('--route-counts', type=int, nargs='+',
+                        default=ROUTE_COUNTS)
+    parser.add_argument('--route-lengths', type=int, nargs='+',
+                        default=ROUTE_LENGTHS)
+    parser.add_argument('--trail-lengths', type=int, nargs='+',
+                        default=TRAIL_LENGTHS)
+    parser.add_argument('--repeats', type=int, default=1, help='Number of '
+                        'times to repeat cyclic routes (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    timestamp = dt.datetime.now()
+    output = (args.output or 'electrode_states-%s.json' %
+              timestamp.strftime('%Y%m%dT%H%M%S'))
+    results = run(route_counts=args.route_counts,
+                  route_lengths=args.route_lengths,
+                  trail_lengths=args.trail_lengths, repeats=args.repeats,
+                  seed=args.seed, log=sys.stdout)
+    info = {'timestamp': timestamp.isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(), 'numpy': np.__version__,
+            'pandas': pd.__version__}
+    # Peak resident set size of the whole process.
+    info['peak_rss_bytes'] = peak_rss()
+    with open(output, 'w') as output_file:
+        json.dump({'info': info, 'results': results}, output_file, indent=2)
+    print('Wrote results to `%s`' % output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,836 @@
+'''
+Plan droplet routes over the electrode adjacency graph of a device.
+
+.. versionadded:: 2.6
+'''
+from collections import Counter
+import hashlib
+import heapq
+import os
+
+from logging_helpers import _L
+import numpy as np
+import pandas as pd
+
+from .routes import as_route_table
+from .schedule import route_cells
+
+#: Default number of landmarks used for A* lower bounds (see
+#: :class:`ElectrodeGraph`).
+DEFAULT_LANDMARKS = 8
+#: Distance between unconnected electrodes in :class:`PathIndex` tables.
+UNREACHABLE = np.iinfo('uint16').max
+#: Largest graph to build a :class:`PathIndex` for (tables take ``4 *
+#: electrodes ** 2`` bytes, i.e., 64 MB for 4096 electrodes).
+MAX_INDEX_ELECTRODES = 4096
+
+
+class ElectrodeGraph(object):
+    '''
+    Undirected graph of adjacent electrodes.
+
+    Adjacency is stored in compressed sparse row (CSR) form, i.e., the
+    neighbours of electrode code ``i`` are ``indices[indptr[i]:indptr[i +
+    1]]``.
+
+    Shortest routes are found using A* search, guided by *ALT* (A*,
+    landmarks, triangle inequality) lower bounds: the hop distance from a
+    few *landmark* electrodes to every electrode is precomputed once, and
+    ``max_k |d(L_k, v) - d(L_k, target)|`` is a consistent lower bound on the
+    hop distance from electrode ``v`` to the target.
+
+    If :attr:`path_index` is set, routes are instead read from the
+    precomputed all-pairs table (see :class:`PathIndex`).
+
+    Parameters
+    ----------
+    adjacency : dict or pandas.DataFrame or list
+        Electrode adjacency, either as:
+
+         - a mapping from each electrode identifier to a list of identifiers
+           of adjacent electrodes;
+         - a table with ``source`` and ``target`` columns, e.g., the
+           connections table of a device; or
+         - a list of ``(source, target)`` electrode identifier pairs.
+
+        Adjacency is symmetric, i.e., each connection may be listed in
+        either direction.
+    landmarks : int, optional
+        Number of landmark electrodes.
+    '''
+    def __init__(self, adjacency, landmarks=DEFAULT_LANDMARKS):
+        electrodes, sources, targets = _connections(adjacency)
+        #: Electrode identifiers, indexed by electrode code.
+        self.electrodes = electrodes
+        self._electrode_index = dict((e, i) for i, e in enumerate(electrodes))
+        self.indptr, self.indices = _csr(len(electrodes), sources, targets)
+        # Neighbour lists for (fast) scalar access during search.
+        self._neighbours = [self.indices[self.indptr[i]:self.indptr[i + 1]]
+                            .tolist() for i in xrange(len(electrodes))]
+        self.landmarks, self.landmark_distances = \
+            self._select_landmarks(landmarks)
+        #: All-pairs shortest path table (see :class:`PathIndex`), if any.
+        self.path_index = None
+
+    def __len__(self):
+        return len(self.electrodes)
+
+    def __repr__(self):
+        return ('<ElectrodeGraph: %d electrodes, %d connections>' %
+                (len(self.electrodes), self.indices.shape[0] // 2))
+
+    def digest(self):
+        '''
+        Returns
+        -------
+        str
+            Hash of electrode identifiers and adjacency.
+        '''
+        sha1 = hashlib.sha1()
+        sha1.update('\0'.join(map(str, self.electrodes)).encode('utf8'))
+        for array_i in (self.indptr, self.indices):
+            sha1.update(np.ascontiguousarray(array_i).tobytes())
+        return sha1.hexdigest()
+
+    def electrode_code(self, electrode_id):
+        '''
+        Returns
+        -------
+        int
+
+        Raises
+        ------
+        KeyError
+            If electrode is not in graph.
+        '''
+        try:
+            return self._electrode_index[electrode_id]
+        except KeyError:
+            raise KeyError('Unknown electrode: `%s`' % electrode_id)
+
+    def neighbours(self, electrode_id):
+        '''
+        Returns
+        -------
+        list
+            Identifiers of electrodes adjacent to the specified electrode.
+        '''
+        return [self.electrodes[i] for i in
+                self._neighbours[self.electrode_code(electrode_id)]]
+
+    def distances(self, code):
+        '''
+        Parameters
+        ----------
+        code : int
+            Electrode code.
+
+        Returns
+        -------
+        numpy.ndarray
+            Hop distance from electrode to every electrode (``-1`` where
+            unreachable).
+        '''
+        distances = np.full(len(self.electrodes), -1, dtype='int32')
+        distances[code] = 0
+        frontier = np.array([code])
+        distance = 0
+        while frontier.shape[0]:
+            distance += 1
+            # Neighbours of all electrodes in frontier.
+            starts, stops = self.indptr[frontier], self.indptr[frontier + 1]
+            neighbours = self.indices[_ranges(starts, stops)]
+            frontier = np.unique(neighbours[distances[neighbours] < 0])
+            distances[frontier] = distance
+        return distances
+
+    def shortest_path(self, source, target):
+        '''
+        Parameters
+        ----------
+        source, target : str
+            Electrode identifiers.
+
+        Returns
+        -------
+        list or None
+            Identifiers of electrodes along a shortest route from
+            :data:`source` to :data:`target` (inclusive), or ``None`` if
+            target is unreachable.
+        '''
+        codes = self.shortest_path_codes(self.electrode_code(source),
+                                         self.electrode_code(target))
+        if codes is None:
+            return None
+        return [self.electrodes[i] for i in codes]
+
+    def shortest_path_codes(self, source, target):
+        '''
+        Parameters
+        ----------
+        source, target : int
+            Electrode codes.
+
+        Returns
+        -------
+        list or None
+            Codes of electrodes along a shortest route from :data:`source`
+            to :data:`target` (inclusive), or ``None`` if target is
+            unreachable.
+        '''
+        if self.path_index is not None:
+            return self.path_index.path_codes(source, target)
+        if source == target:
+            return [source]
+        heuristic = self._heuristic(source, target)
+        if heuristic is None:
+            return None
+
+        neighbours = self._neighbours
+        cost = {source: 0}
+        parent = {source: None}
+        # Break ties in favour of deeper nodes, i.e., closer to target.
+        queue = [(heuristic[source], 0, source)]
+        while queue:
+            _, depth, u = heapq.heappop(queue)
+            if u == target:
+                break
+            depth = -depth
+            if depth > cost[u]:
+                # Stale queue entry.
+                continue
+            depth += 1
+            for v in neighbours[u]:
+                if depth < cost.get(v, depth + 1):
+                    cost[v] = depth
+                    parent[v] = u
+                    heapq.heappush(queue, (depth + heuristic[v], -depth, v))
+        else:
+            return None
+
+        path = [target]
+        while parent[path[-1]] is not None:
+            path.append(parent[path[-1]])
+        return path[::-1]
+
+    def _heuristic(self, source, target):
+        '''
+        Returns
+        -------
+        list or None
+            ALT lower bound on hop distance to :data:`target` from each
+            electrode code, or ``None`` if :data:`source` and :data:`target`
+            are not connected.
+        '''
+        distances = self.landmark_distances
+        to_target = distances[:, target]
+        from_source = distances[:, source]
+        if ((to_target < 0) != (from_source < 0)).any():
+            # Some landmark reaches exactly one of source and target, i.e.,
+            # they belong to different connected components.
+            return None
+        valid = (distances >= 0) & (to_target >= 0)[:, None]
+        bounds = np.where(valid, np.abs(distances - to_target[:, None]), 0)
+        return bounds.max(axis=0).tolist()
+
+    def _select_landmarks(self, count):
+        '''
+        Select landmarks by farthest-point traversal, i.e., each landmark is
+        the electrode farthest from the landmarks selected so far.
+
+        Unreachable electrodes count as infinitely far, so each connected
+        component gets a landmark (as long as there are enough landmarks).
+
+        Returns
+        -------
+        landmarks : numpy.ndarray
+            Landmark electrode codes.
+        distances : numpy.ndarray
+            ``(landmarks, electrodes)`` hop distances (``-1`` where
+            unreachable).
+        '''
+        size = len(self.electrodes)
+        count = min(count, size)
+        landmarks = np.zeros(count, dtype='int32')
+        distances = np.empty((count, size), dtype='int32')
+        nearest = np.full(size, np.iinfo('int32').max, dtype='int64')
+        code = 0
+        for k in xrange(count):
+            landmarks[k] = code
+            distances[k] = self.distances(code)
+            nearest = np.minimum(nearest, np.where(distances[k] < 0,
+                                                   nearest, distances[k]))
+            code = int(nearest.argmax())
+        return landmarks, distances
+
+
+class PathIndex(object):
+    '''
+    All-pairs shortest path table of an :class:`ElectrodeGraph`.
+
+    Finding a route is a walk along the :attr:`next_hop` table, i.e.,
+    ``O(route length)`` without any search.
+
+    Tables are stored as ``.npy`` files, keyed by the digest of the graph
+    (see :meth:`ElectrodeGraph.digest`), and loaded memory-mapped so that
+    later sessions do not have to recompute them.
+
+    Parameters
+    ----------
+    distances : numpy.ndarray
+        ``(electrodes, electrodes)`` hop distance between each pair of
+        electrode codes (:data:`UNREACHABLE` if not connected).
+    next_hop : numpy.ndarray
+        ``(electrodes, electrodes)`` code of next electrode on a shortest
+        route from the row electrode to the column electrode (``-1`` if not
+        connected).
+    '''
+    def __init__(self, distances, next_hop):
+        self.distances = distances
+        self.next_hop = next_hop
+
+    @classmethod
+    def build(cls, graph):
+        '''
+        Compute all-pairs shortest paths using breadth-first search from
+        every electrode at once.
+
+        Parameters
+        ----------
+        graph : ElectrodeGraph
+
+        Returns
+        -------
+        PathIndex
+        '''
+        size = len(graph)
+        if size > MAX_INDEX_ELECTRODES:
+            raise ValueError('Graph is too large to index: %d electrodes '
+                             '(max: %d).' % (size, MAX_INDEX_ELECTRODES))
+        indptr, indices = graph.indptr, graph.indices
+        degree = np.diff(indptr)
+        # `k`-th neighbour of each electrode, or `size` (i.e., the index of
+        # an extra row that is never set) if it has fewer neighbours.
+        last = max(indices.shape[0] - 1, 0)
+        neighbours = [np.where(degree > k,
+                               indices[np.minimum(indptr[:-1] + k, last)],
+                               size)
+                      for k in xrange(degree.max() if size else 0)]
+
+        distances = np.full((size, size), UNREACHABLE, dtype='uint16')
+        np.fill_diagonal(distances, 0)
+        # Column `j` of `reached`/`frontier` is the search from electrode
+        # `j`.
+        reached = np.eye(size, dtype=bool)
+        frontier = np.zeros((size + 1, size), dtype=bool)
+        frontier[:size] = reached
+        distance = 0
+        while neighbours and frontier.any():
+            distance += 1
+            # Row `v` is set for each search whose frontier includes a
+            # neighbour of electrode `v`.
+            next_frontier = frontier[neighbours[0]]
+            for neighbours_k in neighbours[1:]:
+                next_frontier |= frontier[neighbours_k]
+            next_frontier &= ~reached
+            reached |= next_frontier
+            # Hop distances are symmetric.
+            distances[next_frontier] = distance
+            frontier[:size] = next_frontier
+
+        next_hop = np.full((size, size), -1, dtype='int16')
+        for u in xrange(size):
+            neighbours = indices[indptr[u]:indptr[u + 1]]
+            if neighbours.shape[0]:
+                # Neighbour closest to each target is on a shortest route.
+                closest = neighbours[distances[neighbours].argmin(axis=0)]
+                next_hop[u] = np.where(distances[u] == UNREACHABLE, -1,
+                                       closest)
+            next_hop[u, u] = u
+        return cls(distances, next_hop)
+
+    @classmethod
+    def load(cls, directory, key):
+        '''
+        Returns
+        -------
+        PathIndex or None
+            Memory-mapped tables stored under :data:`key` in
+            :data:`directory`, or ``None`` if not found.
+        '''
+        try:
+            return cls(*[np.load(filename, mmap_mode='r') for filename in
+                         _index_paths(directory, key)])
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, directory, key):
+        '''
+        Store tables under :data:`key` in :data:`directory`.
+        '''
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for array_i, filename in zip((self.distances, self.next_hop),
+                                     _index_paths(directory, key)):
+            # Write to temporary file and rename, so that a partially written
+            # table is never loaded.
+            temp_filename = filename + '.tmp'
+            with open(temp_filename, 'wb') as output:
+                np.save(output, array_i)
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.rename(temp_filename, filename)
+
+    @classmethod
+    def cached(cls, graph, directory):
+        '''
+        Load tables of graph from :data:`directory`, or build (and store)
+        them if not found.
+
+        Returns
+        -------
+        PathIndex or None
+            Path index of graph, or ``None`` if graph is too large to index
+            (see :data:`MAX_INDEX_ELECTRODES`).
+        '''
+        if len(graph) > MAX_INDEX_ELECTRODES:
+            return None
+        key = graph.digest()
+        index = cls.load(directory, key)
+        if index is None:
+            index = cls.build(graph)
+            try:
+                index.save(directory, key)
+            except (IOError, OSError):
+                _L().warning('Error saving path index to `%s`.', directory,
+                             exc_info=True)
+        return index
+
+    def path_codes(self, source, target):
+        '''
+        Parameters
+        ----------
+        source, target : int
+            Electrode codes.
+
+        Returns
+        -------
+        list or None
+            Codes of electrodes along a shortest route from :data:`source`
+            to :data:`target` (inclusive), or ``None`` if target is
+            unreachable.
+        '''
+        if self.distances[source, target] == UNREACHABLE:
+            return None
+        path = [source]
+        while path[-1] != target:
+            path.append(int(self.next_hop[path[-1], target]))
+        return path
+
+
+class ReservationTable(object):
+    '''
+    Time-expanded table of electrodes reserved by planned droplet routes.
+
+    A droplet on electrode ``u`` in frame ``t`` reserves ``u`` *and its
+    neighbours* in frames ``t - 1``, ``t`` and ``t + 1``, i.e., other
+    droplets may neither be adjacent to it nor move next to where it just
+    was (which would merge the droplets).  Once a droplet reaches the end of
+    its route it stays there, i.e., it reserves its neighbourhood in all
+    later frames.
+
+    Parameters
+    ----------
+    graph : ElectrodeGraph
+    '''
+    def __init__(self, graph):
+        self._neighbourhoods = [[u] + neighbours for u, neighbours in
+                                enumerate(graph._neighbours)]
+        # Number of droplets reserving each `(electrode code, frame)`.
+        self._reserved = Counter()
+        # Latest reserved frame of each electrode code.
+        self._last = {}
+        # First frame from which each electrode code is reserved for good.
+        self._parked = {}
+
+    def is_free(self, code, frame):
+        return ((code, frame) not in self._reserved and
+                self._parked.get(code, frame + 1) > frame)
+
+    def is_free_after(self, code, frame):
+        '''
+        Returns
+        -------
+        bool
+            ``True`` if electrode is free in :data:`frame` and all later
+            frames, i.e., a droplet may stay there.
+        '''
+        return (code not in self._parked and
+                self._last.get(code, frame - 1) < frame)
+
+    def reserve(self, codes, park=True):
+        '''
+        Reserve electrodes along route.
+
+        Parameters
+        ----------
+        codes : list
+            Code of electrode occupied by droplet in each frame.
+        park : bool, optional
+            If ``True``, droplet stays on last electrode of route.
+        '''
+        for cell in self._cells(codes):
+            self._reserved[cell] += 1
+            self._last[cell[0]] = max(self._last.get(cell[0], cell[1]),
+                                      cell[1])
+        if park:
+            frame = len(codes) - 1
+            for w in self._neighbourhoods[codes[-1]]:
+                self._parked[w] = min(self._parked.get(w, frame), frame)
+
+    def release(self, codes):
+        '''
+        Release electrodes reserved along route with ``park=False``.
+        '''
+        for cell in self._cells(codes):
+            self._reserved[cell] -= 1
+            if self._reserved[cell] < 1:
+                del self._reserved[cell]
+
+    def _cells(self, codes):
+        for frame, u in enumerate(codes):
+            for w in self._neighbourhoods[u]:
+                for frame_j in (frame - 1, frame, frame + 1):
+                    yield w, frame_j
+
+
+def plan_routes(graph, pairs, max_frames=None):
+    '''
+    Plan conflict-free routes for several droplets moving at once.
+
+    Droplets are planned one at a time using A* search over ``(electrode,
+    frame)`` states, where a droplet may either move to an adjacent electrode
+    or wait in place each frame, against a :class:`ReservationTable` of the
+    routes planned so far (i.e., *cooperative A**).  Droplets with the
+    longest shortest routes are planned first, since they bound the
+    makespan (i.e., number of frames until all droplets arrive).  If a
+    droplet cannot be routed, it is moved to the front of the planning order
+    and planning starts over.
+
+    Routes assume a trail length of 1, i.e., a single electrode per droplet
+    is actuated in each frame.
+
+    .. versionadded:: 2.6
+
+    Parameters
+    ----------
+    graph : ElectrodeGraph
+    pairs : list
+        ``(source, target)`` electrode identifiers of each droplet.
+    max_frames : int, optional
+        Maximum number of frames of any route (default: sum of shortest
+        route lengths plus number of droplets).
+
+    Returns
+    -------
+    list
+        Route of each droplet, i.e., identifier of electrode occupied by
+        droplet in each frame, in order of :data:`pairs`.  Waiting in place
+        repeats an electrode.  Routes of droplets that do not move contain
+        a single electrode.
+
+    Raises
+    ------
+    ValueError
+        If droplets start or end next to each other, a target is
+        unreachable, or routes cannot be planned without conflicts.
+    '''
+    codes = [(graph.electrode_code(source), graph.electrode_code(target))
+             for source, target in pairs]
+    for name, ends in (('sources', [s for s, t in codes]),
+                       ('targets', [t for s, t in codes])):
+        occupied = Counter(w for u in ends for w in [u] +
+                           graph._neighbours[u])
+        if any(occupied[u] > 1 for u in ends):
+            raise ValueError('Droplet %s must not be adjacent.' % name)
+    # Exact hop distance to each target, ignoring other droplets.
+    heuristics = [graph.distances(target) for source, target in codes]
+    lengths = [heuristic[source] for heuristic, (source, target) in
+               zip(heuristics, codes)]
+    if min(lengths or [0]) < 0:
+        raise ValueError('Target is unreachable.')
+    if max_frames is None:
+        max_frames = sum(lengths) + len(pairs)
+
+    order = sorted(xrange(len(pairs)), key=lambda i: -lengths[i])
+    for attempt in xrange(len(pairs)):
+        table = ReservationTable(graph)
+        for source, target in codes:
+            # Droplets which are not planned yet sit on their sources.
+            table.reserve([source], park=False)
+        routes = [None] * len(pairs)
+        for i in order:
+            source, target = codes[i]
+            table.release([source])
+            routes[i] = _plan_route(graph, table, source, target,
+                                    heuristics[i].tolist(), max_frames)
+            if routes[i] is None:
+                break
+            table.reserve(routes[i])
+        else:
+            return [[graph.electrodes[u] for u in route] for route in routes]
+        if order[0] == i:
+            break
+        order.remove(i)
+        order.insert(0, i)
+    raise ValueError('Could not plan conflict-free routes within %d frames.'
+                     % max_frames)
+
+
+def route_offsets(df_routes, graph=None):
+    '''
+    Assign start offsets (see :meth:`routes.RouteTable.set_start_offsets`)
+    so that independent routes overlap, while routes that conflict run one
+    after the other.
+
+    Two routes conflict if they share an electrode or, if :data:`graph` is
+    specified, pass over adjacent electrodes.  Routes are placed in order of
+    route identifier (i.e., the order they were drawn in), and each route
+    starts as soon as all earlier conflicting routes have ended.  This
+    preserves the order of routes drawn one after the other, e.g., routes
+    that move the same droplet.
+
+    .. versionadded:: 2.6
+
+    Parameters
+    ----------
+    df_routes : pandas.DataFrame or routes.RouteTable
+        Table of route transitions.
+    graph : ElectrodeGraph, optional
+        Electrode adjacency graph.
+
+    Returns
+    -------
+    dict
+        Start offset of each route, keyed by route identifier.
+    '''
+    routes = as_route_table(df_routes)
+    codes = routes.electrode_codes
+    near = _nearby_electrodes(routes, graph)
+
+    # Frame after the end of the last placed route on each electrode.
+    busy_until = np.zeros(len(routes.electrodes), dtype=int)
+    offsets = {}
+    route_ids, inverse = np.unique(routes.route_i, return_inverse=True)
+    order = np.argsort(inverse, kind='mergesort')
+    starts = np.searchsorted(inverse[order], np.arange(route_ids.shape[0]))
+    for route_i, rows in zip(route_ids, np.split(order, starts[1:])):
+        electrodes = np.unique(codes[rows])
+        nearby = np.unique([code for code_i in electrodes
+                            for code in near[code_i]])
+        offset = int(busy_until[nearby].max())
+        busy_until[electrodes] = np.maximum(busy_until[electrodes],
+                                            offset + rows.shape[0])
+        offsets[int(route_i)] = offset
+    return offsets
+
+
+def route_conflicts(df_routes, trail_length=1, graph=None):
+    '''
+    Find frames where droplets of different routes are on the same or, if
+    :data:`graph` is specified, adjacent electrodes.
+
+    All active cells of all routes are joined against each other in a single
+    vectorized pass, keyed by ``(frame, electrode)``.
+
+    .. versionadded:: 2.6
+
+    Parameters
+    ----------
+    df_routes : pandas.DataFrame or routes.RouteTable
+        Table of route transitions.
+    trail_length : int, optional
+        Number of electrodes to turn on along route at once.
+    graph : ElectrodeGraph, optional
+        Electrode adjacency graph.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Table with a row for each conflicting ``(frame, route_a, route_b)``,
+        where ``route_a < route_b``, and an example of conflicting electrodes
+        (i.e., ``electrode_a`` and ``electrode_b``).  Frames are numbered
+        as in :func:`schedule.route_cells`, i.e., frames beyond the first
+        pass belong to the first repeated pass through **cyclic** routes.
+    '''
+    routes = as_route_table(df_routes)
+    frame_i, row_i = route_cells(routes, trail_length=trail_length)
+    route_i = routes.route_i[row_i].astype('int64')
+    codes = routes.electrode_codes[row_i].astype('int64')
+    size = max(len(routes.electrodes), 1)
+
+    # Sort cells by `(frame, electrode)`.
+    keys = frame_i.astype('int64') * size + codes
+    order = np.argsort(keys, kind='mergesort')
+    keys = keys[order]
+
+    # Look up cells on electrodes near each cell in the same frame.
+    indptr, indices = _csr_lists(_nearby_electrodes(routes, graph))
+    counts = indptr[codes + 1] - indptr[codes]
+    cell_a = np.repeat(np.arange(codes.shape[0]), counts)
+    near_keys = (frame_i[cell_a].astype('int64') * size +
+                 indices[_ranges(indptr[codes], indptr[codes + 1])])
+    lower = np.searchsorted(keys, near_keys, side='left')
+    upper = np.searchsorted(keys, near_keys, side='right')
+    cell_b = order[_ranges(lower, upper)]
+    cell_a = np.repeat(cell_a, upper - lower)
+
+    # Each conflict is found from both routes; keep one of each pair.
+    conflict = route_i[cell_a] < route_i[cell_b]
+    cell_a, cell_b = cell_a[conflict], cell_b[conflict]
+    electrode_i = routes.electrode_i[row_i]
+    df_conflicts = pd.DataFrame({'frame': frame_i[cell_a],
+                                 'route_a': route_i[cell_a],
+                                 'route_b': route_i[cell_b],
+                                 'electrode_a': electrode_i[cell_a],
+                                 'electrode_b': electrode_i[cell_b]},
+                                columns=['frame', 'route_a', 'route_b',
+                                         'electrode_a', 'electrode_b'])
+    return (df_conflicts.drop_duplicates(['frame', 'route_a', 'route_b'])
+            .sort_values(['frame', 'route_a', 'route_b'])
+            .reset_index(drop=True))
+
+
+def _nearby_electrodes(routes, graph=None):
+    '''
+    Returns
+    -------
+    list
+        Codes of electrodes near each electrode code of route table, i.e.,
+        the electrode itself and, if :data:`graph` is specified, its
+        neighbours in the table.
+    '''
+    near = [[code] for code in xrange(len(routes.electrodes))]
+    if graph is not None:
+        for code, electrode_id in enumerate(routes.electrodes):
+            if electrode_id in graph._electrode_index:
+                near[code].extend(routes.electrode_code(neighbour)
+                                  for neighbour in
+                                  graph.neighbours(electrode_id)
+                                  if neighbour in routes._electrode_index)
+    return near
+
+
+def _csr_lists(lists):
+    '''
+    Returns
+    -------
+    indptr, indices : numpy.ndarray
+        Compressed sparse row form of list of lists of integers.
+    '''
+    indptr = np.zeros(len(lists) + 1, dtype='int64')
+    indptr[1:] = np.cumsum([len(list_i) for list_i in lists])
+    indices = np.fromiter((i for list_i in lists for i in list_i),
+                          dtype='int64', count=indptr[-1])
+    return indptr, indices
+
+
+def _plan_route(graph, table, source, target, heuristic, max_frames):
+    '''
+    Returns
+    -------
+    list or None
+        Code of electrode occupied by droplet in each frame, or ``None`` if
+        no conflict-free route exists within :data:`max_frames`.
+    '''
+    if not table.is_free(source, 0):
+        return None
+    neighbours = graph._neighbours
+    parent = {(source, 0): None}
+    queue = [(heuristic[source], 0, source)]
+    while queue:
+        _, frame, u = heapq.heappop(queue)
+        if u == target and table.is_free_after(u, frame):
+            route = [(u, frame)]
+            while parent[route[-1]] is not None:
+                route.append(parent[route[-1]])
+            return [code for code, _ in reversed(route)]
+        if frame >= max_frames:
+            continue
+        next_frame = frame + 1
+        for v in [u] + neighbours[u]:
+            state = v, next_frame
+            # Each state has a fixed cost (its frame), so the first visit is
+            # along a shortest route.
+            if (state in parent or heuristic[v] < 0 or
+                    not table.is_free(v, next_frame)):
+                continue
+            parent[state] = u, frame
+            heapq.heappush(queue, (next_frame + heuristic[v], next_frame, v))
+    return None
+
+
+def _index_paths(directory, key):
+    return [os.path.join(directory, '%s-%s.npy' % (key, name))
+            for name in ('distances', 'next_hop')]
+
+
+def _connections(adjacency):
+    '''
+    Returns
+    -------
+    electrodes : list
+        Sorted electrode identifiers.
+    sources, targets : numpy.ndarray
+        Electrode codes of connection end points.
+    '''
+    if hasattr(adjacency, 'columns'):
+        pairs = list(zip(adjacency['source'], adjacency['target']))
+        isolated = []
+    elif hasattr(adjacency, 'items'):
+        pairs = [(source, target) for source, targets in adjacency.items()
+                 for target in targets]
+        isolated = list(adjacency)
+    else:
+        pairs = [tuple(pair) for pair in adjacency]
+        isolated = []
+    electrodes = sorted(set(isolated).union(*zip(*pairs)) if pairs else
+                        isolated)
+    index = dict((e, i) for i, e in enumerate(electrodes))
+    codes = np.array([(index[s], index[t]) for s, t in pairs],
+                     dtype='int32').reshape(-1, 2)
+    return electrodes, codes[:, 0], codes[:, 1]
+
+
+def _csr(size, sources, targets):
+    '''
+    Returns
+    -------
+    indptr, indices : numpy.ndarray
+        Compressed sparse row form of symmetric adjacency (self-connections
+        and duplicate connections are dropped).
+    '''
+    rows = np.concatenate([sources, targets]).astype('int64')
+    columns = np.concatenate([targets, sources]).astype('int64')
+    keys = np.unique((rows * size + columns)[rows != columns])
+    rows, indices = keys // size, (keys % size).astype('int32')
+    indptr = np.zeros(size + 1, dtype='int32')
+    indptr[1:] = np.cumsum(np.bincount(rows, minlength=size))
+    return indptr, indices
+
+
+def _ranges(starts, stops):
+    '''
+    Returns
+    -------
+    numpy.ndarray
+        Concatenation of ``arange(start, stop)`` for each range.
+    '''
+    lengths = stops - starts
+    total = lengths.sum()
+    if total < 1:
+        return np.zeros(0, dtype='int64')
+    # Offset of each element from the start of its range.
+    offsets = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths,
+                                           lengths)
+    return np.repeat(starts, lengths) + offsets
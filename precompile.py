@@ -0,0 +1,158 @@
+'''
+Compile schedules of protocol steps in the background.
+
+.. versionadded:: 2.6
+'''
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from logging_helpers import _L
+
+from .routes import as_route_table
+from .schedule import compile_schedule, schedule_key
+
+
+class SchedulePrecompiler(object):
+    '''
+    Compile schedules on a worker thread and store them in a
+    :class:`schedule.ScheduleCache`.
+
+    Compiling a schedule takes about a millisecond for typical steps (e.g.,
+    60 routes of 20 transitions), so a thread is used rather than worker
+    processes, which would need to pickle route tables and schedules and
+    import the plugin package.  Compilation is mostly NumPy array
+    operations, which release the GIL.
+
+    Parameters
+    ----------
+    cache : schedule.ScheduleCache
+        Cache to store compiled schedules in.
+    max_workers : int, optional
+        Number of worker threads.
+    '''
+    def __init__(self, cache, max_workers=1):
+        self.cache = cache
+        self.max_workers = max_workers
+        self._executor = None
+        # Pending/running compilations, keyed by schedule key.
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, df_routes, trail_length=1):
+        '''
+        Compile schedule in the background, unless it is already cached or
+        being compiled.
+
+        Returns
+        -------
+        tuple
+            Schedule key (see :func:`schedule.schedule_key`).
+        '''
+        routes = as_route_table(df_routes)
+        key = schedule_key(routes, trail_length=trail_length)
+        with self._lock:
+            if key in self.cache or key in self._futures:
+                return key
+            # Route tables are modified in place (e.g., by `add_route()`)
+            # while the worker thread compiles, so submit a snapshot.
+            future = self.executor.submit(compile_schedule, routes.copy(),
+                                          trail_length=trail_length)
+            self._futures[key] = future
+        future.add_done_callback(lambda future: self._on_done(key, future))
+        return key
+
+    def submit_all(self, items):
+        '''
+        Cancel pending compilations and compile the schedules of the
+        specified ``(routes, trail_length)`` items in the background.
+
+        Returns
+        -------
+        list
+            Schedule key of each item.
+        '''
+        self.cancel()
+        return [self.submit(df_routes, trail_length=trail_length)
+                for df_routes, trail_length in items]
+
+    def cancel(self):
+        '''
+        Cancel compilations that have not started yet.
+        '''
+        with self._lock:
+            futures = list(self._futures.values())
+        for future in futures:
+            # Cancelled futures are removed by `_on_done()`.
+            future.cancel()
+
+    def compile(self, df_routes, trail_length=1):
+        '''
+        Returns
+        -------
+        schedule.Schedule
+            Cached schedule for the specified routes and options.  If a
+            background compilation is running, wait for it.  Otherwise,
+            compile (and cache) the schedule in the current thread.
+        '''
+        routes = as_route_table(df_routes)
+        key = schedule_key(routes, trail_length=trail_length)
+        schedule = self.cache.get(key)
+        if schedule is not None:
+            return schedule
+        with self._lock:
+            future = self._futures.get(key)
+        if future is not None and future.cancel():
+            future = None
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                _L().debug('Background compilation failed.', exc_info=True)
+        schedule = compile_schedule(routes, trail_length=trail_length)
+        self.cache.put(key, schedule)
+        return schedule
+
+    def result(self, key):
+        '''
+        Returns
+        -------
+        schedule.Schedule or None
+            Cached schedule with the specified key, waiting for background
+            compilation if necessary, or ``None`` if the schedule is neither
+            cached nor being compiled.
+        '''
+        schedule = self.cache.get(key)
+        if schedule is None:
+            with self._lock:
+                future = self._futures.get(key)
+            if future is not None and not future.cancelled():
+                try:
+                    schedule = future.result()
+                except Exception:
+                    _L().debug('Background compilation failed.',
+                               exc_info=True)
+        return schedule
+
+    def shutdown(self):
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _on_done(self, key, future):
+        # Cache the schedule *before* forgetting the future, so `result()`
+        # always finds one or the other.
+        if not future.cancelled():
+            try:
+                self.cache.put(key, future.result())
+            except Exception:
+                _L().warning('Error compiling schedule.', exc_info=True)
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
@@ -0,0 +1,636 @@
+'''
+Compact, array-backed storage of droplet route tables.
+
+.. versionadded:: 2.6
+'''
+import hashlib
+import itertools
+import json
+import struct
+import time
+
+import numpy as np
+import pandas as pd
+
+#: Columns of route table :class:`pandas.DataFrame` views.
+COLUMNS = ['route_i', 'electrode_i', 'transition_i']
+#: Optional column of frame offset of the start of each route within a pass,
+#: only included in :class:`pandas.DataFrame` views if any route is offset.
+OFFSET_COLUMN = 'start_offset'
+# Row arrays of `RouteTable`.
+_ARRAYS = ('_route_i', '_electrode_codes', '_transition_i', '_start_offset')
+#: Identifier of columnar route table encoding (see
+#: :meth:`RouteTable.to_columnar`).
+COLUMNAR_MAGIC = b'DPRT'
+#: Version of columnar route table encoding.
+COLUMNAR_VERSION = 1
+# Header of columnar encoding: magic, version, reserved, number of rows and
+# size of electrode dictionary (in bytes).
+_COLUMNAR_HEADER = struct.Struct('<4sHHII')
+# Columns of columnar encoding, in order.
+_COLUMNAR_COLUMNS = ('route_i', 'electrode_code', 'transition_i',
+                     'start_offset')
+# Source of route table versions, shared by all tables so that a version
+# identifies a single table state.  Seeded from the clock (in microseconds)
+# so versions keep increasing across restarts.
+_VERSIONS = itertools.count(int(time.time() * 1e6))
+
+
+class RouteTable(object):
+    '''
+    Table of droplet route transitions, stored as contiguous ``int32``
+    arrays.
+
+    Each row of the table corresponds to a single route *transition*, i.e.,
+    a ``(route_i, electrode_i, transition_i)`` record.  Electrode identifiers
+    are *interned*, i.e., stored once in :attr:`electrodes` and referenced by
+    an ``int32`` code in each row.
+
+    Rows are stored in arrays with spare capacity so that appending a route
+    costs amortized ``O(route length)``.  Each modification assigns the
+    table a new :attr:`version`, e.g., to check if a copy is up to date.
+
+    Use :meth:`to_frame` to get a :class:`pandas.DataFrame` view of the table
+    with the columns ``route_i``, ``electrode_i`` and ``transition_i`` (and
+    ``start_offset``, if any route is offset; see :meth:`set_start_offsets`).
+
+    Note
+    ----
+    A pickled :class:`RouteTable` is restored as a
+    :class:`pandas.DataFrame`, i.e., the route table format of previous
+    versions of the plugin.  Use :func:`as_route_table` to convert a
+    restored table.
+    '''
+    __slots__ = _ARRAYS + ('_size', 'electrodes', '_electrode_index',
+                           'next_route_i', '_electrode_routes', 'version')
+
+    def __init__(self, capacity=0):
+        for name in _ARRAYS:
+            setattr(self, name, np.empty(capacity, dtype='int32'))
+        self._size = 0
+        #: Interned electrode identifiers, indexed by electrode code.
+        self.electrodes = []
+        self._electrode_index = {}
+        #: Route identifier assigned to the next appended route.
+        self.next_route_i = 0
+        # Identifiers of routes including each electrode code, built on
+        # first use (see `electrode_routes()`).
+        self._electrode_routes = None
+        #: Version of table content, increased each time the table is
+        #: modified.  Versions are unique across all tables.
+        self.version = next(_VERSIONS)
+
+    @classmethod
+    def from_frame(cls, df_routes):
+        '''
+        Parameters
+        ----------
+        df_routes : pandas.DataFrame
+            Table of route transitions with the columns ``route_i``,
+            ``electrode_i`` and ``transition_i``, and optionally
+            ``start_offset``.
+
+        Returns
+        -------
+        RouteTable
+            Route table with the same rows as :data:`df_routes`.
+        '''
+        size = df_routes.shape[0]
+        table = cls(capacity=size)
+        if size > 0:
+            electrodes, codes = np.unique(df_routes.electrode_i.values,
+                                          return_inverse=True)
+            table._route_i[:] = df_routes.route_i.values
+            table._electrode_codes[:] = codes
+            table._transition_i[:] = df_routes.transition_i.values
+            if OFFSET_COLUMN in df_routes:
+                table._start_offset[:] = df_routes[OFFSET_COLUMN].values
+            else:
+                table._start_offset[:] = 0
+            table._size = size
+            table.electrodes = electrodes.tolist()
+            table._electrode_index = dict((e, i) for i, e in
+                                          enumerate(table.electrodes))
+            table.next_route_i = int(table._route_i.max()) + 1
+        return table
+
+    @classmethod
+    def from_columnar(cls, buffer):
+        '''
+        Parameters
+        ----------
+        buffer : bytes
+            Route table in columnar encoding (see :meth:`to_columnar`).
+
+        Returns
+        -------
+        RouteTable
+            Route table decoded from :data:`buffer`.
+        '''
+        columns, electrodes = read_columnar(buffer)
+        size = columns['route_i'].shape[0]
+        table = cls(capacity=size)
+        for name, column in zip(_ARRAYS, _COLUMNAR_COLUMNS):
+            getattr(table, name)[:] = columns[column]
+        table._size = size
+        table.electrodes = electrodes
+        table._electrode_index = dict((e, i) for i, e in
+                                      enumerate(electrodes))
+        if size > 0:
+            table.next_route_i = int(table.route_i.max()) + 1
+        return table
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return ('<RouteTable: %d routes, %d transitions>' %
+                (self.route_ids().shape[0], self._size))
+
+    def __reduce_ex__(self, protocol):
+        # Pickle as a `pandas.DataFrame` to keep saved protocols readable by
+        # previous versions.
+        return pd.DataFrame, (self._columns(), None, self._column_names())
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    ###########################################################################
+    # Column views
+    @property
+    def route_i(self):
+        return self._route_i[:self._size]
+
+    @property
+    def electrode_codes(self):
+        return self._electrode_codes[:self._size]
+
+    @property
+    def transition_i(self):
+        return self._transition_i[:self._size]
+
+    @property
+    def start_offset(self):
+        return self._start_offset[:self._size]
+
+    @property
+    def electrode_i(self):
+        '''
+        Electrode identifier of each row.
+        '''
+        electrodes = np.empty(len(self.electrodes), dtype=object)
+        electrodes[:] = self.electrodes
+        return electrodes[self.electrode_codes]
+
+    def to_frame(self, rows=None):
+        '''
+        Parameters
+        ----------
+        rows : slice, optional
+            Range of rows to include (default: all rows), e.g., rows of
+            routes just appended.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Table of route transitions with the columns ``route_i``,
+            ``electrode_i`` and ``transition_i`` (and ``start_offset``, if
+            any route is offset).
+        '''
+        return pd.DataFrame(self._columns(rows),
+                            columns=self._column_names(rows))
+
+    def to_columnar(self):
+        '''
+        Encode route table as a compact binary buffer, e.g., to send over
+        ZeroMQ without pickling a :class:`pandas.DataFrame`.
+
+        The buffer consists of:
+
+         1. A 16-byte header: :data:`COLUMNAR_MAGIC`, the ``uint16`` encoding
+            version, a reserved ``uint16``, and the ``uint32`` number of rows
+            and size of the electrode dictionary (in bytes).
+         2. The little-endian ``int32`` columns ``route_i``,
+            ``electrode_code``, ``transition_i`` and ``start_offset``, one
+            after another.
+         3. The electrode dictionary, i.e., UTF-8 encoded JSON list of
+            electrode identifiers, indexed by electrode code.
+
+        Use :func:`read_columnar` to decode the columns without copying, or
+        :meth:`from_columnar` to decode a :class:`RouteTable`.
+
+        Returns
+        -------
+        bytes
+            Encoded route table.
+        '''
+        electrodes = json.dumps(self.electrodes).encode('utf8')
+        header = _COLUMNAR_HEADER.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, 0,
+                                       self._size, len(electrodes))
+        return b''.join([header] +
+                        [getattr(self, name)[:self._size].astype('<i4')
+                         .tobytes() for name in _ARRAYS] + [electrodes])
+
+    def _column_names(self, rows=None):
+        if self.start_offset[rows or slice(None)].any():
+            return COLUMNS + [OFFSET_COLUMN]
+        return COLUMNS
+
+    def _columns(self, rows=None):
+        if rows is None:
+            rows = slice(None)
+            electrode_i = self.electrode_i
+        else:
+            # Only look up identifiers of electrodes in range of rows.
+            codes = self.electrode_codes[rows].tolist()
+            electrode_i = np.empty(len(codes), dtype=object)
+            electrode_i[:] = [self.electrodes[code] for code in codes]
+        columns = {'route_i': self.route_i[rows].copy(),
+                   'electrode_i': electrode_i,
+                   'transition_i': self.transition_i[rows].copy()}
+        if self.start_offset[rows].any():
+            columns[OFFSET_COLUMN] = self.start_offset[rows].copy()
+        return columns
+
+    def copy(self):
+        table = RouteTable(capacity=self._size)
+        for name in _ARRAYS:
+            getattr(table, name)[:] = getattr(self, name)[:self._size]
+        table._size = self._size
+        table.electrodes = list(self.electrodes)
+        table._electrode_index = self._electrode_index.copy()
+        table.next_route_i = self.next_route_i
+        # Copy has the same content, and is assigned a new version once
+        # modified.
+        table.version = self.version
+        return table
+
+    def digest(self):
+        '''
+        Returns
+        -------
+        str
+            Hash of table *content*, i.e., rows with electrodes identified
+            by identifier.  Tables with the same rows have the same hash,
+            regardless of the order electrodes were interned in or of
+            interned electrodes no longer used by any row.
+        '''
+        # Re-code electrodes used by rows in order of identifier.
+        used, codes = np.unique(self.electrode_codes, return_inverse=True)
+        electrodes = np.empty(used.shape[0], dtype=object)
+        electrodes[:] = [self.electrodes[i] for i in used]
+        order = np.argsort(electrodes, kind='mergesort')
+        canonical = np.empty(used.shape[0], dtype='int32')
+        canonical[order] = np.arange(used.shape[0])
+
+        sha1 = hashlib.sha1()
+        for name in _ARRAYS:
+            if name == '_electrode_codes':
+                array_i = canonical[codes.ravel()]
+            else:
+                array_i = getattr(self, name)[:self._size]
+            sha1.update(np.ascontiguousarray(array_i).tobytes())
+        sha1.update('\0'.join(map(str, electrodes[order])).encode('utf8'))
+        return sha1.hexdigest()
+
+    ###########################################################################
+    # Queries
+    def electrode_code(self, electrode_id):
+        '''
+        Returns
+        -------
+        int or None
+            Interned code of electrode, or ``None`` if electrode is not in
+            table.
+        '''
+        return self._electrode_index.get(electrode_id)
+
+    def route_ids(self):
+        '''
+        Returns
+        -------
+        numpy.ndarray
+            Sorted unique route identifiers.
+        '''
+        return np.unique(self.route_i)
+
+    def routes_with_electrode(self, electrode_id):
+        '''
+        Look up routes in inverted index (see :meth:`electrode_routes`),
+        i.e., without scanning all rows.
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted identifiers of routes that include the specified
+            electrode.
+        '''
+        routes = self.electrode_routes().get(self.electrode_code(electrode_id))
+        if not routes:
+            return np.zeros(0, dtype='int32')
+        return np.array(sorted(routes), dtype='int32')
+
+    def electrode_routes(self):
+        '''
+        Inverted index of routes, i.e., identifiers of routes that include
+        each electrode.
+
+        The index is built on first use and then kept up to date as routes
+        are appended or removed.
+
+        Returns
+        -------
+        dict
+            Set of route identifiers, keyed by electrode code.  Must not be
+            modified.
+        '''
+        if self._electrode_routes is None:
+            index = {}
+            keys = np.unique(self.electrode_codes.astype('int64') << 32 |
+                             self.route_i.astype('int64') & 0xFFFFFFFF)
+            for code, route_i in zip((keys >> 32).tolist(),
+                                     (keys & 0xFFFFFFFF).astype('int32')
+                                     .tolist()):
+                index.setdefault(code, set()).add(route_i)
+            self._electrode_routes = index
+        return self._electrode_routes
+
+    ###########################################################################
+    # Mutators
+    def intern(self, electrode_ids):
+        '''
+        Returns
+        -------
+        numpy.ndarray
+            Interned code of each electrode, adding new electrodes to
+            :attr:`electrodes` as necessary.
+        '''
+        codes = np.empty(len(electrode_ids), dtype='int32')
+        for i, electrode_id in enumerate(electrode_ids):
+            code = self._electrode_index.get(electrode_id)
+            if code is None:
+                code = self._electrode_index[electrode_id] = \
+                    len(self.electrodes)
+                self.electrodes.append(electrode_id)
+            codes[i] = code
+        return codes
+
+    def reserve(self, capacity):
+        '''
+        Grow arrays to hold at least :data:`capacity` rows.
+        '''
+        if capacity <= self._route_i.shape[0]:
+            return
+        # Grow geometrically so repeated appends cost amortized O(1) per row.
+        capacity = max(capacity, 2 * self._route_i.shape[0], 16)
+        for name in _ARRAYS:
+            array_i = np.empty(capacity, dtype='int32')
+            array_i[:self._size] = getattr(self, name)[:self._size]
+            setattr(self, name, array_i)
+
+    def append_route(self, electrode_ids, route_i=None, start_offset=0):
+        '''
+        Append route.
+
+        Parameters
+        ----------
+        electrode_ids : list
+            Ordered list of identifiers of electrodes on route.
+        route_i : int, optional
+            Route identifier (default: :attr:`next_route_i`).
+        start_offset : int, optional
+            Number of frames to delay start of route within each pass.
+
+        Returns
+        -------
+        int
+            Route identifier.
+        '''
+        if route_i is None:
+            route_i = self.next_route_i
+        self.next_route_i = max(self.next_route_i, route_i + 1)
+        codes = self.intern(electrode_ids)
+        start, end = self._size, self._size + codes.shape[0]
+        self.reserve(end)
+        self._route_i[start:end] = route_i
+        self._electrode_codes[start:end] = codes
+        self._transition_i[start:end] = np.arange(codes.shape[0])
+        self._start_offset[start:end] = start_offset
+        self._size = end
+        if self._electrode_routes is not None:
+            for code in set(codes.tolist()):
+                self._electrode_routes.setdefault(code, set()).add(route_i)
+        self.version = next(_VERSIONS)
+        return route_i
+
+    def set_start_offsets(self, offsets):
+        '''
+        Set number of frames to delay the start of each route within each
+        pass.
+
+        Parameters
+        ----------
+        offsets : dict
+            Start offset of each route, keyed by route identifier.  Routes
+            not listed are not modified.
+        '''
+        route_ids = np.fromiter(offsets.keys(), dtype='int64',
+                                count=len(offsets))
+        values = np.fromiter(offsets.values(), dtype='int32',
+                             count=len(offsets))
+        if (values < 0).any():
+            raise ValueError('Start offsets must not be negative.')
+        order = np.argsort(route_ids)
+        route_ids, values = route_ids[order], values[order]
+        i = np.searchsorted(route_ids, self.route_i).clip(max=max(
+            route_ids.shape[0] - 1, 0))
+        found = (route_ids[i] == self.route_i if route_ids.shape[0] else
+                 np.zeros(self._size, dtype=bool))
+        self.start_offset[found] = values[i[found]]
+        self.version = next(_VERSIONS)
+
+    def remove_routes(self, route_ids):
+        '''
+        Remove all rows of the specified routes.
+
+        Parameters
+        ----------
+        route_ids : list
+            Identifiers of routes to remove.
+
+        Returns
+        -------
+        int
+            Number of rows removed.
+        '''
+        keep = ~np.in1d(self.route_i, route_ids)
+        if self._electrode_routes is not None:
+            removed = ~keep
+            for code, route_i in zip(self.electrode_codes[removed].tolist(),
+                                     self.route_i[removed].tolist()):
+                routes = self._electrode_routes.get(code)
+                if routes is not None:
+                    routes.discard(route_i)
+                    if not routes:
+                        del self._electrode_routes[code]
+        return self._compact(keep)
+
+    def clear(self):
+        '''
+        Remove all routes.
+        '''
+        self._size = 0
+        self.electrodes = []
+        self._electrode_index = {}
+        self.next_route_i = 0
+        self._electrode_routes = None
+        self.version = next(_VERSIONS)
+
+    def subset(self, route_ids):
+        '''
+        Returns
+        -------
+        RouteTable
+            Table containing only the rows of the specified routes.
+        '''
+        table = self.copy()
+        table._compact(np.in1d(table.route_i, route_ids))
+        return table
+
+    def route_electrodes(self):
+        '''
+        Returns
+        -------
+        list
+            Ordered list of identifiers of electrodes on each route, in order
+            of route identifier.
+        '''
+        if not self._size:
+            return []
+        order = np.lexsort((self.transition_i, self.route_i))
+        route_i = self.route_i[order]
+        codes = self.electrode_codes[order].tolist()
+        # Index of first row of each route (except the first route).
+        bounds = (np.flatnonzero(route_i[1:] != route_i[:-1]) + 1).tolist()
+        electrodes = self.electrodes
+        return [[electrodes[code] for code in codes[start:end]]
+                for start, end in zip([0] + bounds, bounds + [len(codes)])]
+
+    def _compact(self, keep):
+        size = int(keep.sum())
+        removed = self._size - size
+        if removed:
+            for name in _ARRAYS:
+                array_i = getattr(self, name)
+                array_i[:size] = array_i[:self._size][keep]
+            self._size = size
+            self.version = next(_VERSIONS)
+        return removed
+
+
+def as_route_table(routes):
+    '''
+    Parameters
+    ----------
+    routes : RouteTable or pandas.DataFrame or None
+        Route table, e.g., as restored from a saved protocol.
+
+    Returns
+    -------
+    RouteTable
+        Route table (:data:`routes` itself if it is already a
+        :class:`RouteTable`).
+    '''
+    if routes is None:
+        return RouteTable()
+    elif isinstance(routes, RouteTable):
+        return routes
+    return RouteTable.from_frame(routes)
+
+
+def route_changes(old, new):
+    '''
+    Find routes that differ between two route tables.
+
+    A route that is in both tables, but with different electrodes or start
+    offset, is both removed and added.
+
+    Parameters
+    ----------
+    old, new : RouteTable
+        Route tables.
+
+    Returns
+    -------
+    added : list
+        Sorted identifiers of routes of :data:`new` that are not in
+        :data:`old`.
+    removed : list
+        Sorted identifiers of routes of :data:`old` that are not in
+        :data:`new`.
+    '''
+    old_routes, new_routes = _route_blocks(old), _route_blocks(new)
+    added = sorted(route_i for route_i, block in new_routes.items()
+                   if old_routes.get(route_i) != block)
+    removed = sorted(route_i for route_i, block in old_routes.items()
+                     if new_routes.get(route_i) != block)
+    return added, removed
+
+
+def _route_blocks(table):
+    # Electrodes and start offset of each route, keyed by route identifier.
+    offsets = dict(zip(table.route_i.tolist(), table.start_offset.tolist()))
+    return dict((route_i, (tuple(electrode_ids), offsets[route_i]))
+                for route_i, electrode_ids in
+                zip(table.route_ids().tolist(), table.route_electrodes()))
+
+
+def read_columnar(buffer):
+    '''
+    Decode route table from columnar encoding (see
+    :meth:`RouteTable.to_columnar`).
+
+    Parameters
+    ----------
+    buffer : bytes
+        Encoded route table.
+
+    Returns
+    -------
+    columns : dict
+        Read-only ``int32`` arrays ``route_i``, ``electrode_code``,
+        ``transition_i`` and ``start_offset``, backed by :data:`buffer`
+        (i.e., not copied).
+    electrodes : list
+        Electrode identifiers, indexed by electrode code.
+
+    Raises
+    ------
+    ValueError
+        If :data:`buffer` is not a route table in a supported columnar
+        encoding.
+    '''
+    if len(buffer) < _COLUMNAR_HEADER.size:
+        raise ValueError('Buffer is too short for columnar route table.')
+    magic, version, _, size, electrodes_size = \
+        _COLUMNAR_HEADER.unpack_from(buffer)
+    if magic != COLUMNAR_MAGIC:
+        raise ValueError('Buffer is not a columnar route table.')
+    elif version != COLUMNAR_VERSION:
+        raise ValueError('Unsupported columnar route table version: %s' %
+                         version)
+    offset = _COLUMNAR_HEADER.size
+    end = offset + 4 * size * len(_COLUMNAR_COLUMNS) + electrodes_size
+    if len(buffer) != end:
+        raise ValueError('Expected %d bytes for columnar route table, got %d.'
+                         % (end, len(buffer)))
+    columns = {}
+    for name in _COLUMNAR_COLUMNS:
+        columns[name] = np.frombuffer(buffer, dtype='<i4', count=size,
+                                      offset=offset)
+        offset += 4 * size
+    electrodes = json.loads(bytes(buffer[offset:]).decode('utf8'))
+    return columns, electrodes
@@ -0,0 +1,704 @@
+'''
+Compile droplet route tables into dense electrode actuation schedules.
+
+.. versionadded:: 2.6
+'''
+from collections import OrderedDict
+import hashlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .routes import as_route_table
+
+#: Default memory budget of :class:`ScheduleCache` (in bytes).
+DEFAULT_CACHE_BYTES = 64 << 20
+
+
+def _route_info(route_i, electrode_i):
+    '''
+    Parameters
+    ----------
+    route_i : numpy.ndarray
+        Route identifier of each transition, in table order.
+    electrode_i : numpy.ndarray
+        Electrode identifier (or code) of each transition, in table order.
+
+    Returns
+    -------
+    route_length : numpy.ndarray
+        Number of transitions in the route of each transition.
+    cyclic : numpy.ndarray
+        ``True`` for each transition belonging to a **cyclic** route, i.e.,
+        a route where the first electrode matches the last electrode.
+    '''
+    _, first, codes, counts = np.unique(route_i, return_index=True,
+                                        return_inverse=True,
+                                        return_counts=True)
+    last = route_i.shape[0] - 1 - np.unique(route_i[::-1],
+                                            return_index=True)[1]
+    cyclic_routes = electrode_i[first] == electrode_i[last]
+    return counts[codes], cyclic_routes[codes]
+
+
+def _active_transitions(transition_i, route_length, cyclic, start, stop,
+                        trail_length):
+    '''
+    Parameters
+    ----------
+    transition_i, route_length, cyclic : numpy.ndarray
+        Per-transition attributes (see :func:`_route_info`).
+    start, stop : int
+        Range of values of the transition counter to evaluate.
+    trail_length : int
+        Number of electrodes to turn on along route at once.
+
+    Returns
+    -------
+    frame_i : numpy.ndarray
+        Value of the transition counter of each active ``(frame,
+        transition)`` cell.
+    row_i : numpy.ndarray
+        Transition index of each active cell.
+    '''
+    frame_i = []
+    row_i = []
+
+    def _append(frames, rows, mask):
+        mask &= (frames >= start) & (frames < stop)
+        frame_i.append(frames[mask])
+        row_i.append(rows[mask])
+
+    # Trail follows transition corresponding to *transition counter* by the
+    # specified *trail length*.
+    #
+    # Rather than evaluating every `(frame, transition)` cell, enumerate the
+    # (few) frames in which each transition may be active.
+    #
+    #  1. Within the specified trail length of the current transition counter
+    #     of a single pass, i.e., counter in `[t - trail_length + 1, t]`.
+    rows = np.arange(transition_i.shape[0])
+    if rows.shape[0] > 0:
+        for k in xrange(max(0, min(trail_length,
+                                   transition_i.max() - start + 1))):
+            frames = transition_i - k
+            _append(frames, rows, np.ones_like(rows, dtype=bool))
+
+    # Only consider wrap-around transitions for the second pass of cyclic
+    # routes.
+    cyclic_j = np.flatnonzero(cyclic)
+    if cyclic_j.shape[0] > 0:
+        length_j = route_length[cyclic_j]
+        transition_j = transition_i[cyclic_j]
+        #  3. Start marker is higher than end marker, i.e., end has wrapped
+        #     around to the start of the route.  This only happens when the
+        #     start marker is within `wrap_j` transitions of the end of the
+        #     route.
+        wrap_j = (trail_length - 1) % length_j
+        for k in xrange(wrap_j.max()):
+            start_mod = length_j - wrap_j + k
+            end_mod = k
+            active = ((k < wrap_j) & ((transition_j >= start_mod) |
+                                      (transition_j <= end_mod + 1)))
+            for pass_i in (0, 1):
+                frames = pass_i * length_j + start_mod
+                #  2. Within the specified trail length of the current
+                #     transition counter in the second route pass.
+                second_pass = (np.maximum(frames + trail_length - 1, frames) <
+                               2 * length_j)
+                _append(frames, cyclic_j, active & second_pass)
+    if not frame_i:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    return np.concatenate(frame_i), np.concatenate(row_i)
+
+
+def _pass_cells(routes, trail_length):
+    '''
+    Parameters
+    ----------
+    routes : routes.RouteTable
+        Table of route transitions (at least one).
+    trail_length : int
+        Number of electrodes to turn on along route at once.
+
+    Returns
+    -------
+    list
+        ``(start, stop, rows, frame_i, row_i)`` tuple for the first pass
+        through **all** routes and for each subsequent pass through
+        **cyclic** routes, where:
+
+         - ``start, stop`` is the range of frames in the pass;
+         - ``rows`` are the table rows included in the pass; and
+         - ``frame_i, row_i`` are the frame and table row of each active
+           ``(frame, transition)`` cell.
+
+        The transition counter of each route is delayed by the start offset
+        of the route within each pass.
+    '''
+    transition_i = routes.transition_i.astype(int)
+    route_length, cyclic = _route_info(routes.route_i,
+                                       routes.electrode_codes)
+    offsets = routes.start_offset.astype(int)
+    # Frame after the end of each route (within a pass).
+    route_end = route_length + offsets
+
+    # Only *cyclic* routes are repeated.  Each repeated pass starts at the
+    # second transition, since the first electrode matches the last.
+    cyclic_j = np.flatnonzero(cyclic)
+    passes = [(0, np.arange(transition_i.shape[0])),
+              (1, cyclic_j)]
+    cells = []
+    for start, rows in passes:
+        stop = route_end[rows].max() if rows.shape[0] else start
+        frame_i, row_j = _active_transitions(transition_i[rows],
+                                             route_length[rows],
+                                             cyclic[rows], start, stop,
+                                             trail_length)
+        frame_i = frame_i + offsets[rows][row_j]
+        in_range = frame_i < stop
+        cells.append((start, stop, rows, frame_i[in_range],
+                      rows[row_j[in_range]]))
+    return cells
+
+
+def frame_runs(states):
+    '''
+    Parameters
+    ----------
+    states : numpy.ndarray
+        ``(frames, electrodes)`` boolean actuation states.
+
+    Returns
+    -------
+    starts : numpy.ndarray
+        Index of first frame of each run of identical consecutive frames.
+    counts : numpy.ndarray
+        Number of frames in each run.
+    '''
+    if states.shape[0] < 1:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    starts = np.flatnonzero(np.r_[True, (states[1:] != states[:-1])
+                                  .any(axis=1)])
+    counts = np.diff(np.r_[starts, states.shape[0]])
+    return starts, counts
+
+
+class Schedule(object):
+    '''
+    Compiled actuation schedule for a table of droplet routes.
+
+    Attributes
+    ----------
+    electrodes : pandas.Index
+        Sorted identifiers of electrodes on routes, i.e., schedule columns.
+    first_pass : numpy.ndarray
+        ``(frames, electrodes)`` boolean actuation states for the first pass
+        through **all** routes.
+    cycle : numpy.ndarray
+        ``(frames, electrodes)`` boolean actuation states for each subsequent
+        pass through **cyclic** routes.
+    cycle_columns : numpy.ndarray
+        Indexes of schedule columns for electrodes on **cyclic** routes.
+    '''
+    def __init__(self, electrodes, first_pass, cycle, cycle_columns):
+        self.electrodes = electrodes
+        self.first_pass = first_pass
+        self.cycle = cycle
+        self.cycle_columns = cycle_columns
+
+    @property
+    def nbytes(self):
+        return (self.first_pass.nbytes + self.cycle.nbytes +
+                self.cycle_columns.nbytes + self.electrodes.nbytes)
+
+    def series(self, states, columns=None):
+        '''
+        Parameters
+        ----------
+        states : numpy.ndarray
+            Row of :attr:`first_pass` or :attr:`cycle`.
+        columns : numpy.ndarray, optional
+            Schedule columns to include (default: all).
+
+        Returns
+        -------
+        pandas.Series
+            Actuation states indexed by electrode id (i.e., ``electrode_i``),
+            with "on" electrodes listed first.
+        '''
+        return states_series(self.electrodes, states, columns)
+
+    def channel_schedule(self, channel_map):
+        '''
+        Reduce schedule to actuation states of channels.
+
+        Use :meth:`ScheduleCache.channel_schedule` to reuse reduced
+        schedules.
+
+        .. versionadded:: 2.6
+
+        Parameters
+        ----------
+        channel_map : ChannelMap
+            Electrode to channel mapping.
+
+        Returns
+        -------
+        ChannelSchedule
+            Schedule where a channel is on if *any* of its electrodes is on.
+            Electrodes that are not mapped to any channel are dropped.
+        '''
+        channels, matrix = channel_map.matrix(self.electrodes)
+        weights = matrix.astype('float32')
+
+        def _reduce(states):
+            return np.dot(states.astype('float32'), weights) > 0
+
+        cycle_columns = np.flatnonzero(matrix[self.cycle_columns]
+                                       .any(axis=0))
+        return ChannelSchedule(channels, _reduce(self.first_pass),
+                               _reduce(self.cycle), cycle_columns)
+
+
+class ChannelSchedule(Schedule):
+    '''
+    Compiled actuation schedule of *channels* (see
+    :meth:`Schedule.channel_schedule`).
+
+    Each channel appears once, so frames are emitted as is, without listing
+    "on" states first.
+
+    .. versionadded:: 2.6
+
+    Attributes
+    ----------
+    electrodes : pandas.Index
+        Sorted channel numbers, i.e., schedule columns.
+    '''
+    def series(self, states, columns=None):
+        '''
+        Returns
+        -------
+        pandas.Series
+            Actuation states indexed by channel number.
+        '''
+        if columns is not None:
+            return pd.Series(states[columns], index=self.electrodes[columns],
+                             name='active')
+        return pd.Series(states, index=self.electrodes, name='active')
+
+    def channel_schedule(self, channel_map):
+        raise TypeError('Schedule is already reduced to channels.')
+
+
+class ChannelMap(object):
+    '''
+    Mapping from electrode identifiers to actuation channels.
+
+    An electrode may be mapped to several channels, and several electrodes
+    may share a channel.
+
+    .. versionadded:: 2.6
+
+    Parameters
+    ----------
+    channels : dict or pandas.Series or pandas.DataFrame or list
+        Either:
+
+         - a mapping from each electrode identifier to a channel number or
+           a list of channel numbers;
+         - a table with ``electrode_id`` and ``channel`` columns, e.g., the
+           electrode channels table of a device; or
+         - a list of ``(electrode_id, channel)`` pairs.
+    '''
+    def __init__(self, channels):
+        if hasattr(channels, 'columns'):
+            pairs = zip(channels['electrode_id'], channels['channel'])
+        elif hasattr(channels, 'items'):
+            pairs = [(electrode_id, channel)
+                     for electrode_id, channels_i in channels.items()
+                     for channel in np.atleast_1d(channels_i)]
+        else:
+            pairs = [tuple(pair) for pair in channels]
+        pairs = sorted(set((electrode_id, int(channel))
+                           for electrode_id, channel in pairs))
+        #: Electrode identifier of each mapping.
+        self.electrode_ids = np.empty(len(pairs), dtype=object)
+        self.electrode_ids[:] = [electrode_id for electrode_id, _ in pairs]
+        #: Channel number of each mapping.
+        self.channels = np.array([channel for _, channel in pairs],
+                                 dtype=int)
+        sha1 = hashlib.sha1()
+        sha1.update('\0'.join('%s:%s' % pair for pair in pairs)
+                    .encode('utf8'))
+        self._digest = sha1.hexdigest()
+
+    def __len__(self):
+        return self.channels.shape[0]
+
+    def digest(self):
+        '''
+        Returns
+        -------
+        str
+            Hash of mapping.
+        '''
+        return self._digest
+
+    def matrix(self, electrodes):
+        '''
+        Parameters
+        ----------
+        electrodes : pandas.Index
+            Electrode identifiers.
+
+        Returns
+        -------
+        channels : pandas.Index
+            Sorted numbers of channels mapped to :data:`electrodes`.
+        matrix : numpy.ndarray
+            ``(electrodes, channels)`` boolean matrix, ``True`` where
+            electrode is mapped to channel.
+        '''
+        codes = electrodes.get_indexer(self.electrode_ids)
+        mapped = codes >= 0
+        channels, channel_codes = np.unique(self.channels[mapped],
+                                            return_inverse=True)
+        matrix = np.zeros((electrodes.shape[0], channels.shape[0]),
+                          dtype=bool)
+        matrix[codes[mapped], channel_codes] = True
+        return pd.Index(channels, name='channel'), matrix
+
+
+class PackedStates(object):
+    '''
+    Electrode actuation states packed into a bit array.
+
+    Bit ``i`` corresponds to electrode ``electrodes[i]``, where
+    :attr:`electrodes` is shared by all frames of a schedule.
+
+    .. versionadded:: 2.6
+
+    Parameters
+    ----------
+    electrodes : pandas.Index
+        Electrode identifiers, i.e., electrode to bit index.
+    states : numpy.ndarray
+        Packed (see :func:`numpy.packbits`) actuation states.
+    mask : numpy.ndarray, optional
+        Packed mask of electrodes included in frame (default: all).
+    '''
+    __slots__ = ('electrodes', 'states', 'mask')
+
+    def __init__(self, electrodes, states, mask=None):
+        self.electrodes = electrodes
+        self.states = states
+        self.mask = mask
+
+    def __len__(self):
+        if self.mask is None:
+            return self.electrodes.shape[0]
+        return int(self.columns().shape[0])
+
+    def unpack(self):
+        '''
+        Returns
+        -------
+        numpy.ndarray
+            Boolean actuation states of all electrodes.
+        '''
+        return (np.unpackbits(self.states)[:self.electrodes.shape[0]]
+                .astype(bool))
+
+    def columns(self):
+        '''
+        Returns
+        -------
+        numpy.ndarray or None
+            Indexes of electrodes included in frame (``None`` for all).
+        '''
+        if self.mask is None:
+            return None
+        return np.flatnonzero(np.unpackbits(self.mask)
+                              [:self.electrodes.shape[0]])
+
+    def to_series(self):
+        '''
+        Returns
+        -------
+        pandas.Series
+            Actuation states indexed by electrode id (see
+            :meth:`Schedule.series`).
+        '''
+        return states_series(self.electrodes, self.unpack(), self.columns())
+
+    @classmethod
+    def from_series(cls, states, electrodes):
+        '''
+        Parameters
+        ----------
+        states : pandas.Series
+            Actuation states indexed by electrode id.
+        electrodes : pandas.Index
+            Electrode identifiers, i.e., electrode to bit index.
+
+        Returns
+        -------
+        PackedStates
+            Packed actuation states.
+
+        Raises
+        ------
+        KeyError
+            If :data:`states` includes an electrode not in
+            :data:`electrodes`.
+        '''
+        codes = electrodes.get_indexer(states.index)
+        if (codes < 0).any():
+            raise KeyError('Electrodes not in index: %s' %
+                           ', '.join(map(str, states.index[codes < 0])))
+        unpacked = np.zeros(electrodes.shape[0], dtype=bool)
+        unpacked[codes] = states.values.astype(bool)
+        if codes.shape[0] == electrodes.shape[0]:
+            mask = None
+        else:
+            mask = np.zeros(electrodes.shape[0], dtype=bool)
+            mask[codes] = True
+            mask = np.packbits(mask)
+        return cls(electrodes, np.packbits(unpacked), mask)
+
+
+def states_series(electrodes, states, columns=None):
+    '''
+    Parameters
+    ----------
+    electrodes : pandas.Index
+        Electrode identifiers.
+    states : numpy.ndarray
+        Boolean actuation state of each electrode in :data:`electrodes`.
+    columns : numpy.ndarray, optional
+        Indexes of electrodes to include (default: all).
+
+    Returns
+    -------
+    pandas.Series
+        Actuation states indexed by electrode id (i.e., ``electrode_i``),
+        with "on" electrodes listed first.
+    '''
+    if columns is not None:
+        states = states[columns]
+        electrodes = electrodes[columns]
+    # An electrode may appear twice in the list of modified electrode states
+    # in cases where the same channel is mapped to multiple electrodes.
+    #
+    # List "on" electrodes first so the "on" state will take precedence when
+    # the electrode controller plugin drops duplicate states for the same
+    # electrode.
+    order = np.r_[np.flatnonzero(states), np.flatnonzero(~states)]
+    return pd.Series(states[order], index=electrodes[order], name='active')
+
+
+def compile_schedule(df_routes, trail_length=1):
+    '''
+    Compile actuation states of all frames of the specified routes.
+
+    Each route is delayed by its start offset (see
+    :meth:`routes.RouteTable.set_start_offsets`) within each pass.
+
+    Parameters
+    ----------
+    df_routes : pandas.DataFrame or routes.RouteTable
+        Table of route transitions.
+    trail_length : int, optional
+        Number of electrodes to turn on along route at once.
+
+    Returns
+    -------
+    Schedule
+        Compiled schedule.
+    '''
+    routes = as_route_table(df_routes)
+
+    # Schedule columns are the electrodes on routes, sorted by identifier.
+    used = np.unique(routes.electrode_codes)
+    electrodes = np.empty(used.shape[0], dtype=object)
+    electrodes[:] = [routes.electrodes[i] for i in used]
+    order = np.argsort(electrodes, kind='mergesort')
+    columns = np.empty(len(routes.electrodes), dtype=int)
+    columns[used[order]] = np.arange(used.shape[0])
+    electrode_codes = columns[routes.electrode_codes]
+    electrodes = pd.Index(electrodes[order], name='electrode_i')
+    if len(routes) < 1:
+        empty = np.zeros((0, 0), dtype=bool)
+        return Schedule(electrodes, empty, empty, np.zeros(0, dtype=int))
+
+    blocks = []
+    for start, stop, rows, frame_i, row_i in _pass_cells(routes,
+                                                         trail_length):
+        # An electrode is on if *any* of its transitions is active.
+        states = np.zeros((stop - start, electrodes.shape[0]), dtype=bool)
+        states[frame_i - start, electrode_codes[row_i]] = True
+        blocks.append((states, rows))
+    (first_pass, _), (cycle, cyclic_j) = blocks
+    cycle_columns = np.unique(electrode_codes[cyclic_j])
+    return Schedule(electrodes, first_pass, cycle, cycle_columns)
+
+
+def route_cells(df_routes, trail_length=1):
+    '''
+    Active ``(frame, transition)`` cells of the specified routes.
+
+    .. versionadded:: 2.6
+
+    Parameters
+    ----------
+    df_routes : pandas.DataFrame or routes.RouteTable
+        Table of route transitions.
+    trail_length : int, optional
+        Number of electrodes to turn on along route at once.
+
+    Returns
+    -------
+    frame_i : numpy.ndarray
+        Frame of each active cell, i.e., frames of the first pass through
+        all routes, followed by frames of a *single* repeated pass through
+        **cyclic** routes.
+    row_i : numpy.ndarray
+        Table row (i.e., transition) of each active cell.
+    '''
+    routes = as_route_table(df_routes)
+    if len(routes) < 1:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    first_pass, cycle = _pass_cells(routes, trail_length)
+    first_stop = first_pass[1]
+    cycle_start, _, _, cycle_frames, cycle_rows = cycle
+    return (np.r_[first_pass[3], cycle_frames - cycle_start + first_stop],
+            np.r_[first_pass[4], cycle_rows])
+
+
+def schedule_key(df_routes, trail_length=1):
+    '''
+    Parameters
+    ----------
+    df_routes : pandas.DataFrame or routes.RouteTable
+        Table of route transitions.
+    trail_length : int, optional
+        Number of electrodes to turn on along route at once.
+
+    Returns
+    -------
+    tuple
+        Key identifying the schedule compiled from the specified routes and
+        options, based on the *content* of the routes table.
+    '''
+    return as_route_table(df_routes).digest(), trail_length
+
+
+class ScheduleCache(object):
+    '''
+    Least-recently-used cache of compiled schedules with a memory budget.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Maximum total size of cached schedules (see :attr:`Schedule.nbytes`).
+        Least-recently-used schedules are evicted to stay within budget.
+
+    The cache is thread-safe, e.g., to store schedules compiled in the
+    background.
+    '''
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._schedules = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._schedules)
+
+    def __contains__(self, key):
+        return key in self._schedules
+
+    def get(self, key):
+        '''
+        Returns
+        -------
+        Schedule or None
+            Cached schedule, or ``None`` if :data:`key` is not cached.
+        '''
+        with self._lock:
+            schedule = self._schedules.pop(key, None)
+            if schedule is not None:
+                # Mark as most recently used.
+                self._schedules[key] = schedule
+            return schedule
+
+    def put(self, key, schedule):
+        with self._lock:
+            self.discard(key)
+            if schedule.nbytes > self.max_bytes:
+                return
+            self._schedules[key] = schedule
+            self.nbytes += schedule.nbytes
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self._schedules.popitem(last=False)[1].nbytes
+
+    def discard(self, key):
+        with self._lock:
+            schedule = self._schedules.pop(key, None)
+            if schedule is not None:
+                self.nbytes -= schedule.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._schedules.clear()
+            self.nbytes = 0
+
+    def compile(self, df_routes, trail_length=1):
+        '''
+        Returns
+        -------
+        Schedule
+            Cached schedule for the specified routes and options, compiling
+            (and caching) it if necessary.
+        '''
+        routes = as_route_table(df_routes)
+        key = schedule_key(routes, trail_length=trail_length)
+        schedule = self.get(key)
+        if schedule is None:
+            schedule = compile_schedule(routes, trail_length=trail_length)
+            self.put(key, schedule)
+        return schedule
+
+    def channel_schedule(self, key, schedule, channel_map):
+        '''
+        Reduce schedule to actuation states of channels (see
+        :meth:`Schedule.channel_schedule`).
+
+        Reduced schedules are cached under their own key, so they count
+        towards the memory budget of the cache.
+
+        .. versionadded:: 2.6
+
+        Parameters
+        ----------
+        key : tuple
+            Key of :data:`schedule` (see :func:`schedule_key`).
+        schedule : Schedule
+            Compiled schedule.
+        channel_map : ChannelMap
+            Electrode to channel mapping.
+
+        Returns
+        -------
+        ChannelSchedule
+            Cached reduced schedule, reducing (and caching) it if necessary.
+        '''
+        key = tuple(key) + (channel_map.digest(), )
+        reduced = self.get(key)
+        if reduced is None:
+            reduced = schedule.channel_schedule(channel_map)
+            self.put(key, reduced)
+        return reduced
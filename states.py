@@ -1,14 +1,284 @@
-from datetime import datetime
-import logging
+from collections import OrderedDict, namedtuple
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2 has no monotonic clock in the standard library.  Use the
+    # backport, which reads the monotonic clock of each platform.
+    from monotonic import monotonic
 
 from logging_helpers import _L
+import numpy as np
+
+from .schedule import (ChannelMap, ChannelSchedule, PackedStates,
+                       compile_schedule, frame_runs)
+
+#: Actuation states held for :attr:`count` consecutive frames.
+#:
+#: .. versionadded:: 2.6
+StateRun = namedtuple('StateRun', 'states count')
+#: Sequence of :class:`StateRun` records (i.e., :attr:`body`) repeated
+#: :attr:`iterations` times.
+#:
+#: .. versionadded:: 2.6
+StateLoop = namedtuple('StateLoop', 'body iterations')
+
+
+class RepeatDeadline(object):
+    '''
+    Time budget for repeating **cyclic** routes, measured from the start of a
+    step.
+
+    Rather than polling the clock on every frame, :meth:`passes` is called
+    once previously scheduled passes have been played and works out how
+    many *whole* passes fit in the remaining budget, based on the frame
+    period observed so far.
+
+    .. versionadded:: 2.6
+
+    Parameters
+    ----------
+    duration_s : float
+        Number of seconds to repeat **cyclic** routes.
+    clock : callable, optional
+        Monotonic clock returning time in seconds, e.g., a virtual clock for
+        testing.
+    '''
+    def __init__(self, duration_s, clock=monotonic):
+        self.duration_s = duration_s
+        self.clock = clock
+        self.start_time = clock() if duration_s else None
+
+    def passes(self, frames, pass_frames):
+        '''
+        Parameters
+        ----------
+        frames : int
+            Number of frames played since the start of the step.
+        pass_frames : int
+            Number of frames in each pass through **cyclic** routes.
+
+        Returns
+        -------
+        int
+            Number of whole passes that fit in the remaining time budget.
+        '''
+        if not self.duration_s:
+            return 0
+        elapsed_s = self.clock() - self.start_time
+        remaining_s = self.duration_s - elapsed_s
+        if remaining_s <= 0:
+            return 0
+        elif elapsed_s <= 0 or frames < 1:
+            # Frame period is not known yet.  Play a single pass and check
+            # again.
+            return 1
+        return int(remaining_s // (elapsed_s / frames * pass_frames))
+
+
+class StatesCursor(object):
+    '''
+    Random-access cursor over the frames of a compiled schedule.
+
+    Frames are numbered from the start of the step, i.e., frames of the
+    first pass through all routes, followed by frames of each repeated pass
+    through **cyclic** routes.  Any frame is looked up in constant time, so
+    a step may, e.g., resume where it was paused using :meth:`seek`.
+
+    Passes to fill :data:`repeat_duration_s` are added once the frames
+    planned so far have been played (see :class:`RepeatDeadline`).  The
+    repeat duration is measured from the first frame requested, not from
+    when the cursor is created.
+
+    .. versionadded:: 2.6
+
+    Parameters
+    ----------
+    schedule : schedule.Schedule
+        Compiled schedule (see :func:`schedule.compile_schedule`).
+    repeats : int, optional
+        Number of times to repeat **cyclic** routes.
+    repeat_duration_s : float, optional
+        Number of seconds to repeat **cyclic** routes.
+    clock : callable, optional
+        Monotonic clock used to time :data:`repeat_duration_s`.
+    mode : str, optional
+        Output format of frames, i.e., ``"series"`` (see
+        :func:`schedule_states`), ``"delta"`` (see :func:`schedule_deltas`;
+        a keyframe of all schedule columns is yielded after each seek) or
+        ``"packed"`` (see :func:`schedule_packed`).
+    '''
+    def __init__(self, schedule, repeats=1, repeat_duration_s=0,
+                 clock=monotonic, mode='series'):
+        if mode not in ('series', 'delta', 'packed'):
+            raise ValueError('Unsupported cursor mode: `%s`' % mode)
+        _L().debug('first pass: %s frames, cycle: %s frames, electrodes: %s',
+                   schedule.first_pass.shape[0], schedule.cycle.shape[0],
+                   schedule.electrodes.shape[0])
+        self.schedule = schedule
+        self.mode = mode
+        self._first_frames = schedule.first_pass.shape[0]
+        self._cycle_frames = schedule.cycle.shape[0]
+        self._repeat_duration_s = repeat_duration_s
+        self._clock = clock
+        # Started on first frame (see `next()`).
+        self._deadline = None
+        # Number of frames played, regardless of seeks, to estimate the frame
+        # period.
+        self._played = 0
+        # Number of frames planned so far.
+        self._frames = self._first_frames
+        if self._cycle_frames > 0:
+            # Only repeat *cyclic* routes.
+            self._frames += max(repeats - 1, 0) * self._cycle_frames
+        self._frame = 0
+        # Previous frame, for `"delta"` mode.
+        self._previous = None
+        # Packed blocks, for `"packed"` mode.
+        self._packed = {}
+
+    def __iter__(self):
+        return self
+
+    @property
+    def frames(self):
+        '''
+        Number of frames planned so far.
+        '''
+        return self._frames
+
+    def tell(self):
+        '''
+        Returns
+        -------
+        int
+            Index of next frame.
+        '''
+        return self._frame
+
+    def remaining(self):
+        '''
+        Returns
+        -------
+        int
+            Number of planned frames after the current position (not
+            counting passes that may still be added to fill the repeat
+            duration).
+        '''
+        return self._frames - self._frame
+
+    def seek(self, frame):
+        '''
+        Move to frame.
+
+        If :data:`repeat_duration_s` is set, :data:`frame` may be beyond the
+        frames planned so far, e.g., to resume a step within passes added to
+        fill the repeat duration.  Whole passes through **cyclic** routes
+        are planned up to :data:`frame`, and further passes are only added
+        if they fit in the remaining time budget.
+
+        Parameters
+        ----------
+        frame : int
+            Index of next frame.
+
+        Raises
+        ------
+        IndexError
+            If :data:`frame` is negative, or beyond the frames planned so far
+            and no repeat duration is set (or there are no **cyclic**
+            routes).
+        '''
+        if (frame > self._frames and self._repeat_duration_s and
+                self._cycle_frames > 0):
+            # Plan whole passes up to frame.
+            passes = -(-(frame - self._frames) // self._cycle_frames)
+            self._frames += passes * self._cycle_frames
+        if not 0 <= frame <= self._frames:
+            raise IndexError('Frame %s is out of range [0, %s].' %
+                             (frame, self._frames))
+        self._frame = frame
+        self._previous = None
+
+    def row(self, frame):
+        '''
+        Returns
+        -------
+        states : numpy.ndarray
+            Actuation states of all schedule columns in frame.
+        columns : numpy.ndarray or None
+            Schedule columns included in frame (``None`` for all columns).
+        '''
+        if frame < self._first_frames:
+            return self.schedule.first_pass[frame], None
+        return (self.schedule.cycle[(frame - self._first_frames) %
+                                    self._cycle_frames],
+                self.schedule.cycle_columns)
+
+    def next(self):
+        if self._deadline is None:
+            # Measure repeat duration from the first frame, e.g., not from
+            # when the step was swapped in.
+            self._deadline = RepeatDeadline(self._repeat_duration_s,
+                                            clock=self._clock)
+        if self._frame >= self._frames:
+            passes = (self._deadline.passes(self._played, self._cycle_frames)
+                      if self._cycle_frames > 0 else 0)
+            if passes < 1:
+                raise StopIteration
+            self._frames += passes * self._cycle_frames
+        frame, self._frame = self._frame, self._frame + 1
+        self._played += 1
+        if self.mode == 'packed':
+            return self._packed_row(frame)
+        states, columns = self.row(frame)
+        if self.mode == 'delta':
+            previous, self._previous = self._previous, states
+            if previous is None:
+                # Keyframe, e.g., after seeking into the repeated passes,
+                # lists *all* columns, so that electrodes of routes that are
+                # not repeated are turned off.
+                columns = None
+            else:
+                # Compare *all* columns, so that electrodes of routes that
+                # are not repeated are turned off on entering the repeated
+                # passes (their columns are off in cycle rows).
+                columns = np.flatnonzero(states != previous)
+        return self.schedule.series(states, columns)
+
+    __next__ = next
+
+    def _packed_row(self, frame):
+        cyclic = frame >= self._first_frames
+        if cyclic not in self._packed:
+            # Pack each block of the schedule once.
+            if cyclic:
+                states = self.schedule.cycle
+                mask = np.zeros(states.shape[1], dtype=bool)
+                mask[self.schedule.cycle_columns] = True
+                mask = np.packbits(mask)
+            else:
+                states, mask = self.schedule.first_pass, None
+            self._packed[cyclic] = np.packbits(states, axis=1), mask
+        rows, mask = self._packed[cyclic]
+        if cyclic:
+            frame = (frame - self._first_frames) % self._cycle_frames
+        return PackedStates(self.schedule.electrodes, rows[frame], mask)
 
 
 def electrode_states(df_routes, trail_length=1, repeats=1,
-                     repeat_duration_s=0):
+                     repeat_duration_s=0, clock=monotonic, mode='series',
+                     channels=None):
     '''
     Yield consecutive electrode actuation states for the specified routes.
 
+    .. versionchanged:: 2.6
+        - Compile all frames up front using
+          :func:`schedule.compile_schedule` and yield rows of the compiled
+          schedule.
+        - Measure :data:`repeat_duration_s` from the start of the step using
+          a monotonic clock (see :class:`RepeatDeadline`), and only repeat
+          *whole* passes through cyclic routes that fit in the time budget.
+
     Parameters
     ----------
     df_routes : pandas.DataFrame
@@ -19,6 +289,19 @@ def electrode_states(df_routes, trail_length=1, repeats=1,
         Number of times to repeat **cyclic** routes.
     repeat_duration_s : float, optional
         Number of seconds to repeat **cyclic** routes.
+    clock : callable, optional
+        Monotonic clock used to time :data:`repeat_duration_s`.
+    mode : str, optional
+        Output mode (see :data:`STATES_MODES`).
+
+        .. versionadded:: 2.6
+    channels : schedule.ChannelMap or dict, optional
+        Electrode to channel mapping.  If specified, yield states of
+        channels instead of electrodes (see
+        :meth:`schedule.Schedule.channel_schedule`).  Required by the
+        ``"channels"`` mode.
+
+        .. versionadded:: 2.6
 
     Yields
     ------
@@ -26,87 +309,219 @@ def electrode_states(df_routes, trail_length=1, repeats=1,
         Actuation states (i.e., ``True`` for **on**, ``False`` for **off**)
         of electrodes listed in :data:`df_routes`, indexed by electrode id
         (i.e., ``electrode_i``).
+
+        Other output modes yield the records documented by the corresponding
+        generator in :data:`STATES_MODES`, e.g., :func:`schedule_packed`.
     '''
-    if df_routes.shape[0] < 1:
-        raise StopIteration
+    schedule = compile_schedule(df_routes, trail_length=trail_length)
+    if channels is not None:
+        if not isinstance(channels, ChannelMap):
+            channels = ChannelMap(channels)
+        schedule = schedule.channel_schedule(channels)
+    return STATES_MODES[mode](schedule, repeats=repeats,
+                              repeat_duration_s=repeat_duration_s,
+                              clock=clock)
 
-    # Find cycle routes, i.e., where first electrode matches last
-    # electrode.
-    route_starts = df_routes.groupby('route_i').nth(0)['electrode_i']
-    route_ends = df_routes.groupby('route_i').nth(-1)['electrode_i']
-    cycles = route_starts[route_starts == route_ends]
-    cyclic_mask = df_routes.route_i.isin(cycles.index.tolist())
 
-    j = 0
-    start_time = datetime.now()
-    while j < repeats or ((datetime.now() - start_time).total_seconds() <
-                          repeat_duration_s):
+def schedule_states(schedule, repeats=1, repeat_duration_s=0,
+                    clock=monotonic):
+    '''
+    Yield consecutive electrode actuation states of a compiled schedule.
 
-        if j > 0:  # Only repeat *cyclic* routes.
-            df_routes_j = df_routes.loc[cyclic_mask].copy()
-            if df_routes_j.shape[0] < 1:
-                raise StopIteration
-        else:
-            df_routes_j = df_routes
-
-        route_groups = df_routes_j.groupby('route_i')
-        # Get the number of transitions in each drop route.
-        route_lengths = route_groups['route_i'].count()
-        df_routes_j['route_length'] = (route_lengths[df_routes_j.route_i]
-                                       .values)
-        df_routes_j['cyclic'] = (df_routes_j.route_i.isin(cycles.index
-                                                          .tolist()))
-
-        start_time = datetime.now()
-
-        for start_i in xrange(0 if j == 0 else 1, int(route_lengths.max())):
-            # Trail follows transition corresponding to *transition counter* by
-            # the specified *trail length*.
-            end_i = (start_i + trail_length - 1)
-
-            if _L().getEffectiveLevel() <= logging.DEBUG:
-                if start_i == end_i:
-                    _L().debug('%s', start_i)
-                else:
-                    _L().debug('%s-%s', start_i, end_i)
-
-            start_i_mod = start_i % df_routes_j.route_length
-            end_i_mod = end_i % df_routes_j.route_length
-
-            #  1. Within the specified trail length of the current transition
-            #     counter of a single pass.
-            single_pass_mask = ((df_routes_j.transition_i >= start_i) &
-                                (df_routes_j.transition_i <= end_i))
-            #  2. Within the specified trail length of the current transition
-            #     counter in the second route pass.
-            second_pass_mask = (max(end_i, start_i) < 2 *
-                                df_routes_j.route_length)
-            #  3. Start marker is higher than end marker, i.e., end has wrapped
-            #     around to the start of the route.
-            wrap_around_mask = ((end_i_mod < start_i_mod) &
-                                ((df_routes_j.transition_i >= start_i_mod) |
-                                 (df_routes_j.transition_i <= end_i_mod + 1)))
-
-            # Find active transitions based on the transition counter.
-            active_transition_mask = (single_pass_mask |
-                                      # Only consider wrap-around transitions for
-                                      # the second pass of cyclic routes.
-                                      (df_routes_j.cyclic & second_pass_mask &
-                                       wrap_around_mask))
-            # (subsequent_pass_mask | wrap_around_mask)))
-
-            df_routes_j['active'] = active_transition_mask.astype(int)
-            active_electrode_mask = (df_routes_j
-                                     .groupby('electrode_i')['active'].sum())
-
-            # An electrode may appear twice in the list of modified electrode
-            # states in cases where the same channel is mapped to multiple
-            # electrodes.
-            #
-            # Sort electrode states with "on" electrodes listed first so the "on"
-            # state will take precedence when the electrode controller plugin drops
-            # duplicate states for the same electrode.
-            modified_electrode_states = (active_electrode_mask.astype(bool)
-                                         .sort_values(ascending=False))
-            yield modified_electrode_states
-        j += 1
+    .. versionadded:: 2.6
+
+    Parameters
+    ----------
+    schedule : schedule.Schedule
+        Compiled schedule (see :func:`schedule.compile_schedule`).
+    repeats : int, optional
+        Number of times to repeat **cyclic** routes.
+    repeat_duration_s : float, optional
+        Number of seconds to repeat **cyclic** routes.
+    clock : callable, optional
+        Monotonic clock used to time :data:`repeat_duration_s`.
+
+    Returns
+    -------
+    StatesCursor
+        Cursor yielding actuation states (i.e., ``True`` for **on**,
+        ``False`` for **off**) of electrodes in schedule, indexed by
+        electrode id (i.e., ``electrode_i``).
+    '''
+    return StatesCursor(schedule, repeats=repeats,
+                        repeat_duration_s=repeat_duration_s, clock=clock)
+
+
+def schedule_channel_states(schedule, repeats=1, repeat_duration_s=0,
+                            clock=monotonic):
+    '''
+    Yield consecutive actuation states of channels, i.e., with electrodes
+    sharing a channel already reduced to a single state.
+
+    .. versionadded:: 2.6
+
+    Parameters
+    ----------
+    schedule : schedule.ChannelSchedule
+        Schedule reduced to channels (see
+        :meth:`schedule.Schedule.channel_schedule`).
+    repeats : int, optional
+        Number of times to repeat **cyclic** routes.
+    repeat_duration_s : float, optional
+        Number of seconds to repeat **cyclic** routes.
+    clock : callable, optional
+        Monotonic clock used to time :data:`repeat_duration_s`.
+
+    Returns
+    -------
+    StatesCursor
+        Cursor yielding actuation states (i.e., ``True`` for **on**,
+        ``False`` for **off**) of channels, indexed by channel number.
+
+    Raises
+    ------
+    TypeError
+        If :data:`schedule` is not reduced to channels.
+    '''
+    if not isinstance(schedule, ChannelSchedule):
+        raise TypeError('Schedule must be reduced to channels (see '
+                        '`Schedule.channel_schedule()`).')
+    return schedule_states(schedule, repeats=repeats,
+                           repeat_duration_s=repeat_duration_s, clock=clock)
+
+
+def schedule_deltas(schedule, repeats=1, repeat_duration_s=0,
+                    clock=monotonic):
+    '''
+    Yield *changes* in electrode actuation states of a compiled schedule.
+
+    The first frame is a *keyframe*, i.e., it lists the states of all
+    electrodes in the schedule.  Each subsequent frame lists only electrodes
+    whose state changed since the previous frame.
+
+    .. versionadded:: 2.6
+
+    Parameters
+    ----------
+    schedule : schedule.Schedule
+        Compiled schedule (see :func:`schedule.compile_schedule`).
+    repeats : int, optional
+        Number of times to repeat **cyclic** routes.
+    repeat_duration_s : float, optional
+        Number of seconds to repeat **cyclic** routes.
+    clock : callable, optional
+        Monotonic clock used to time :data:`repeat_duration_s`.
+
+    Returns
+    -------
+    StatesCursor
+        Cursor yielding actuation states (i.e., ``True`` for **on**,
+        ``False`` for **off**) of electrodes which changed state, indexed by
+        electrode id (i.e., ``electrode_i``).
+    '''
+    return StatesCursor(schedule, repeats=repeats,
+                        repeat_duration_s=repeat_duration_s, clock=clock,
+                        mode='delta')
+
+
+def schedule_runs(schedule, repeats=1, repeat_duration_s=0,
+                  clock=monotonic):
+    '''
+    Yield run-length encoded electrode actuation states of a compiled
+    schedule.
+
+    Consecutive identical frames are grouped into a single
+    :class:`StateRun` record.  Repeated passes through **cyclic** routes are
+    grouped into a :class:`StateLoop` record.
+
+    .. versionadded:: 2.6
+
+    Parameters
+    ----------
+    schedule : schedule.Schedule
+        Compiled schedule (see :func:`schedule.compile_schedule`).
+    repeats : int, optional
+        Number of times to repeat **cyclic** routes.
+    repeat_duration_s : float, optional
+        Number of seconds to repeat **cyclic** routes.
+    clock : callable, optional
+        Monotonic clock used to time :data:`repeat_duration_s`.
+
+    Yields
+    ------
+    StateRun or StateLoop
+        Actuation states (see :func:`schedule_states`) and number of frames
+        to hold them, or loop over such records.
+    '''
+    def _runs(states, columns=None):
+        return [StateRun(schedule.series(states[i], columns), count)
+                for i, count in zip(*frame_runs(states))]
+
+    deadline = RepeatDeadline(repeat_duration_s, clock=clock)
+    for run in _runs(schedule.first_pass):
+        yield run
+
+    body = None
+    for passes in _repeat_passes(schedule, repeats, deadline):
+        if body is None:
+            body = _runs(schedule.cycle, schedule.cycle_columns)
+        yield StateLoop(body, passes)
+
+
+def schedule_packed(schedule, repeats=1, repeat_duration_s=0,
+                    clock=monotonic):
+    '''
+    Yield consecutive electrode actuation states of a compiled schedule,
+    packed into bit arrays.
+
+    .. versionadded:: 2.6
+
+    Parameters
+    ----------
+    schedule : schedule.Schedule
+        Compiled schedule (see :func:`schedule.compile_schedule`).
+    repeats : int, optional
+        Number of times to repeat **cyclic** routes.
+    repeat_duration_s : float, optional
+        Number of seconds to repeat **cyclic** routes.
+    clock : callable, optional
+        Monotonic clock used to time :data:`repeat_duration_s`.
+
+    Returns
+    -------
+    StatesCursor
+        Cursor yielding :class:`schedule.PackedStates` actuation states,
+        where bit ``i`` corresponds to electrode ``schedule.electrodes[i]``.
+    '''
+    return StatesCursor(schedule, repeats=repeats,
+                        repeat_duration_s=repeat_duration_s, clock=clock,
+                        mode='packed')
+
+
+def _repeat_passes(schedule, repeats, deadline):
+    '''
+    Yield number of passes through **cyclic** routes to play next.
+
+    Each value is requested only once the previously yielded passes (and
+    the first pass through all routes) have been played.
+    '''
+    # Only repeat *cyclic* routes.
+    cycle_frames = schedule.cycle.shape[0]
+    if cycle_frames < 1:
+        return
+    frames = schedule.first_pass.shape[0]
+    passes = max(repeats - 1, deadline.passes(frames, cycle_frames))
+    while passes > 0:
+        yield passes
+        frames += passes * cycle_frames
+        passes = deadline.passes(frames, cycle_frames)
+
+
+#: Electrode state generators, keyed by output mode.
+#:
+#: .. versionadded:: 2.6
+STATES_MODES = OrderedDict([('series', schedule_states),
+                            ('delta', schedule_deltas),
+                            ('runs', schedule_runs),
+                            ('packed', schedule_packed),
+                            ('channels', schedule_channel_states)])
@@ -0,0 +1,38 @@
+'''
+Route tables and electrode graphs shared by tests.
+'''
+import pandas as pd
+
+from ..planning import ElectrodeGraph
+
+
+def random_routes(random, max_routes=6, max_length=9, electrodes=12):
+    '''
+    Random route table, including **cyclic** routes and routes that visit
+    an electrode several times.
+    '''
+    rows = []
+    for route_i in xrange(random.randint(1, max_routes + 1)):
+        codes = random.randint(0, electrodes,
+                               size=random.randint(1, max_length + 1))
+        if codes.shape[0] > 2 and random.rand() < .5:
+            codes[-1] = codes[0]
+        rows.extend((route_i, 'electrode%03d' % code, transition_i)
+                    for transition_i, code in enumerate(codes))
+    return pd.DataFrame(rows, columns=['route_i', 'electrode_i',
+                                       'transition_i'])
+
+
+def grid_graph(rows, columns):
+    '''
+    Graph of electrodes ``electrode<row * columns + column>`` on a grid,
+    each connected to the electrodes above, below, left and right.
+    '''
+    def _id(row, column):
+        return 'electrode%03d' % (row * columns + column)
+
+    pairs = ([(_id(i, j), _id(i, j + 1)) for i in xrange(rows)
+              for j in xrange(columns - 1)] +
+             [(_id(i, j), _id(i + 1, j)) for i in xrange(rows - 1)
+              for j in xrange(columns)])
+    return ElectrodeGraph(pairs)
@@ -0,0 +1,190 @@
+'''
+Check route planning and conflict detection against brute-force searches.
+'''
+import itertools as it
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..planning import (ElectrodeGraph, PathIndex, UNREACHABLE, plan_routes,
+                        route_conflicts)
+from ..routes import RouteTable
+from ..schedule import compile_schedule
+from .helpers import grid_graph, random_routes
+
+
+def bfs_distances(graph, source):
+    distances = {source: 0}
+    frontier = [source]
+    while frontier:
+        next_frontier = []
+        for u in frontier:
+            for v in graph.neighbours(u):
+                if v not in distances:
+                    distances[v] = distances[u] + 1
+                    next_frontier.append(v)
+        frontier = next_frontier
+    return distances
+
+
+def brute_force_conflicts(routes, trail_length=1, graph=None):
+    '''
+    Conflicting ``(frame, route_a, route_b)`` found by comparing the
+    schedules of each pair of routes, compiled separately.
+    '''
+    # Frame after end of first pass through all routes.
+    first_stop = int((routes.start_offset + routes.transition_i).max()) + 1
+    cells = {}
+    for route_i in routes.route_ids().tolist():
+        schedule = compile_schedule(routes.subset([route_i]),
+                                    trail_length=trail_length)
+        cells[route_i] = set()
+        for offset, states in ((0, schedule.first_pass),
+                               (first_stop, schedule.cycle)):
+            for frame_i, column in zip(*np.nonzero(states)):
+                cells[route_i].add((offset + frame_i,
+                                    schedule.electrodes[column]))
+
+    def _near(a, b):
+        return a == b or (graph is not None and a in graph._electrode_index
+                          and b in graph.neighbours(a))
+
+    conflicts = set()
+    for route_a, route_b in it.combinations(sorted(cells), 2):
+        for frame_a, electrode_a in cells[route_a]:
+            for frame_b, electrode_b in cells[route_b]:
+                if frame_a == frame_b and _near(electrode_a, electrode_b):
+                    conflicts.add((frame_a, route_a, route_b))
+    return conflicts
+
+
+def conflict_set(df_conflicts):
+    return set(zip(df_conflicts.frame.tolist(), df_conflicts.route_a.tolist(),
+                   df_conflicts.route_b.tolist()))
+
+
+def test_route_conflicts_match_brute_force():
+    random = np.random.RandomState(0)
+    graph = grid_graph(3, 4)
+    for i in xrange(100):
+        routes = RouteTable.from_frame(random_routes(random))
+        if random.rand() < .5:
+            routes.set_start_offsets(dict((route_i, random.randint(0, 4))
+                                          for route_i in
+                                          routes.route_ids().tolist()))
+        trail_length = random.randint(1, 4)
+        graph_i = graph if random.rand() < .5 else None
+        expected = brute_force_conflicts(routes, trail_length=trail_length,
+                                         graph=graph_i)
+        df_conflicts = route_conflicts(routes, trail_length=trail_length,
+                                       graph=graph_i)
+        assert conflict_set(df_conflicts) == expected
+
+
+def disconnected_graph():
+    '''
+    5x6 grid graph, with electrodes ``electrode029`` and ``electrode030``
+    forming a separate component.
+    '''
+    graph = grid_graph(5, 6)
+    return ElectrodeGraph([(a, b) for a in graph.electrodes
+                           for b in graph.neighbours(a)
+                           if 'electrode029' not in (a, b)] +
+                          [('electrode029', 'electrode030')])
+
+
+def check_shortest_paths(graph):
+    for source in graph.electrodes:
+        distances = bfs_distances(graph, source)
+        for target in graph.electrodes:
+            path = graph.shortest_path(source, target)
+            if target not in distances:
+                assert path is None
+                continue
+            assert path[0] == source and path[-1] == target
+            assert len(path) - 1 == distances[target]
+            for a, b in zip(path[:-1], path[1:]):
+                assert b in graph.neighbours(a)
+
+
+def test_shortest_paths():
+    check_shortest_paths(disconnected_graph())
+
+
+def test_graph_adjacency_formats():
+    graph = grid_graph(3, 4)
+    pairs = [(a, b) for a in graph.electrodes for b in graph.neighbours(a)]
+    adjacency = dict((a, graph.neighbours(a)) for a in graph.electrodes)
+    df_connections = pd.DataFrame(pairs, columns=['source', 'target'])
+    for adjacency_i in (pairs, adjacency, df_connections):
+        graph_i = ElectrodeGraph(adjacency_i)
+        assert sorted(graph_i.electrodes) == sorted(graph.electrodes)
+        for electrode_i in graph.electrodes:
+            assert (sorted(graph_i.neighbours(electrode_i)) ==
+                    sorted(graph.neighbours(electrode_i)))
+    with pytest.raises(KeyError):
+        graph.shortest_path('electrode000', 'missing')
+
+
+def test_path_index_shortest_paths():
+    graph = disconnected_graph()
+    graph.path_index = PathIndex.build(graph)
+    distances = graph.path_index.distances
+    assert distances[graph.electrode_code('electrode029'),
+                     graph.electrode_code('electrode000')] == UNREACHABLE
+    assert (distances == distances.T).all()
+    check_shortest_paths(graph)
+
+
+def test_path_index_cached(tmpdir):
+    graph = disconnected_graph()
+    directory = str(tmpdir.join('paths'))
+    assert PathIndex.load(directory, graph.digest()) is None
+    index = PathIndex.cached(graph, directory)
+    assert sorted(os.listdir(directory)) == \
+        sorted('%s-%s.npy' % (graph.digest(), name)
+               for name in ('distances', 'next_hop'))
+
+    # Tables are loaded (memory-mapped) from the directory.
+    loaded = PathIndex.cached(graph, directory)
+    assert isinstance(loaded.distances, np.memmap)
+    np.testing.assert_array_equal(loaded.distances, index.distances)
+    np.testing.assert_array_equal(loaded.next_hop, index.next_hop)
+
+    # A different graph does not load the tables.
+    assert PathIndex.load(directory, grid_graph(5, 6).digest()) is None
+
+
+def test_planned_routes_are_conflict_free():
+    random = np.random.RandomState(0)
+    graph = grid_graph(8, 8)
+    # Droplets start and end at least 2 electrodes apart.
+    cells = ['electrode%03d' % (row * 8 + column) for row in xrange(0, 8, 2)
+             for column in xrange(0, 8, 2)]
+    for i in xrange(20):
+        count = random.randint(2, 5)
+        sources = random.permutation(cells)[:count].tolist()
+        targets = random.permutation(cells)[:count].tolist()
+        pairs = list(zip(sources, targets))
+        planned = plan_routes(graph, pairs)
+        routes = RouteTable()
+        for (source, target), route in zip(pairs, planned):
+            assert route[0] == source and route[-1] == target
+            for a, b in zip(route[:-1], route[1:]):
+                assert a == b or b in graph.neighbours(a)
+            if len(route) > 1:
+                routes.append_route(route)
+        assert route_conflicts(routes, trail_length=1, graph=graph).empty
+
+
+def test_plan_routes_rejects_adjacent_droplets():
+    graph = grid_graph(4, 4)
+    with pytest.raises(ValueError):
+        plan_routes(graph, [('electrode000', 'electrode015'),
+                            ('electrode001', 'electrode012')])
+    # Target in a separate component.
+    graph = disconnected_graph()
+    with pytest.raises(ValueError):
+        plan_routes(graph, [('electrode000', 'electrode029')])
@@ -0,0 +1,227 @@
+'''
+Check array-backed route tables.
+'''
+import pickle
+import struct
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..routes import RouteTable, as_route_table, read_columnar, route_changes
+
+
+def legacy_routes():
+    '''
+    Route table as saved by previous versions of the plugin.
+    '''
+    return pd.DataFrame([(0, 'a', 0), (0, 'b', 1), (0, 'c', 2),
+                         (2, 'c', 0), (2, 'd', 1)],
+                        columns=['route_i', 'electrode_i', 'transition_i'])
+
+
+def test_append_grows_capacity():
+    routes = RouteTable()
+    for i in xrange(100):
+        assert routes.append_route(['e%d' % j for j in xrange(i % 7 + 1)]) \
+            == i
+        assert routes._route_i.shape[0] >= len(routes)
+    assert len(routes) == sum(i % 7 + 1 for i in xrange(100))
+    # Capacity grows geometrically, i.e., is less than twice the rows.
+    assert routes._route_i.shape[0] < 2 * len(routes)
+    assert routes.route_ids().tolist() == list(xrange(100))
+    assert routes.route_electrodes()[8] == ['e0', 'e1']
+
+
+def test_remove_and_subset():
+    routes = RouteTable()
+    for electrode_ids in ('abc', 'cd', 'de', 'a'):
+        routes.append_route(list(electrode_ids))
+    subset = routes.subset([1, 3])
+    assert subset.route_electrodes() == [['c', 'd'], ['a']]
+    # Subset is a copy.
+    assert len(routes) == 8
+
+    assert routes.remove_routes([0, 2]) == 5
+    assert routes.route_ids().tolist() == [1, 3]
+    assert routes.route_electrodes() == [['c', 'd'], ['a']]
+    assert routes.transition_i.tolist() == [0, 1, 0]
+    # Route identifiers are not reused.
+    assert routes.append_route(['f']) == 4
+
+
+def test_from_legacy_frame():
+    df_routes = legacy_routes()
+    routes = as_route_table(df_routes)
+    assert routes.route_electrodes() == [['a', 'b', 'c'], ['c', 'd']]
+    assert routes.next_route_i == 3
+    pd.testing.assert_frame_equal(routes.to_frame(), df_routes,
+                                  check_dtype=False)
+    assert as_route_table(routes) is routes
+    assert len(as_route_table(None)) == 0
+
+
+def test_pickle_as_frame():
+    routes = as_route_table(legacy_routes())
+    routes.set_start_offsets({2: 3})
+    restored = pickle.loads(pickle.dumps(routes, 2))
+    assert isinstance(restored, pd.DataFrame)
+    assert restored.columns.tolist() == ['route_i', 'electrode_i',
+                                         'transition_i', 'start_offset']
+    assert restored.start_offset.tolist() == [0, 0, 0, 3, 3]
+    assert as_route_table(restored).digest() == routes.digest()
+
+
+def test_digest_depends_on_content_only():
+    routes = RouteTable()
+    routes.append_route(['a', 'b', 'c'])
+    modified = RouteTable()
+    modified.append_route(['a', 'b', 'c'])
+    modified.append_route(['d', 'e'])
+    modified.remove_routes([1])
+    converted = RouteTable.from_frame(routes.to_frame())
+    assert routes.digest() == modified.digest() == converted.digest()
+
+    reordered = RouteTable()
+    reordered.append_route(['a', 'c', 'b'])
+    assert reordered.digest() != routes.digest()
+    routes.set_start_offsets({0: 1})
+    assert routes.digest() != converted.digest()
+
+
+def test_copy_is_independent():
+    routes = as_route_table(legacy_routes())
+    copy = routes.copy()
+    copy.append_route(['x'])
+    copy.remove_routes([0])
+    assert routes.route_electrodes() == [['a', 'b', 'c'], ['c', 'd']]
+    assert np.array_equal(copy.route_ids(), [2, 3])
+
+
+def brute_force_electrode_routes(routes):
+    index = {}
+    for code, route_i in zip(routes.electrode_codes.tolist(),
+                             routes.route_i.tolist()):
+        index.setdefault(code, set()).add(route_i)
+    return index
+
+
+def test_electrode_routes_kept_up_to_date():
+    random = np.random.RandomState(0)
+    routes = RouteTable()
+    for i in xrange(200):
+        action = random.rand()
+        if action < .6:
+            routes.append_route(['e%d' % code for code in
+                                 random.randint(0, 10,
+                                                size=random.randint(1, 6))])
+        elif action < .95:
+            route_ids = routes.route_ids()
+            routes.remove_routes(random.permutation(route_ids)
+                                 [:random.randint(0, 3)].tolist())
+        else:
+            routes.clear()
+        if random.rand() < .5:
+            assert (routes.electrode_routes() ==
+                    brute_force_electrode_routes(routes))
+        for electrode_i in ('e0', 'e5', 'missing'):
+            code = routes.electrode_code(electrode_i)
+            expected = sorted(set(routes.route_i[routes.electrode_codes ==
+                                                 code].tolist())
+                              if code is not None else [])
+            assert (routes.routes_with_electrode(electrode_i).tolist() ==
+                    expected)
+
+
+def test_columnar_round_trip():
+    routes = as_route_table(legacy_routes())
+    routes.append_route([u'\xe9', 'a'], start_offset=2)
+    routes.remove_routes([0])
+    buffer = routes.to_columnar()
+    columns, electrodes = read_columnar(buffer)
+    assert electrodes == routes.electrodes
+    assert columns['electrode_code'].tolist() == \
+        routes.electrode_codes.tolist()
+    # Columns are read-only views of the buffer.
+    assert not columns['route_i'].flags.writeable
+
+    decoded = RouteTable.from_columnar(buffer)
+    pd.testing.assert_frame_equal(decoded.to_frame(), routes.to_frame())
+    assert decoded.digest() == routes.digest()
+    assert decoded.next_route_i == 4
+    # Decoded table may be modified.
+    decoded.append_route(['x'])
+    assert len(RouteTable.from_columnar(RouteTable().to_columnar())) == 0
+
+
+def test_read_columnar_rejects_invalid_buffer():
+    buffer = as_route_table(legacy_routes()).to_columnar()
+    with pytest.raises(ValueError, match='too short'):
+        read_columnar(buffer[:10])
+    with pytest.raises(ValueError, match='not a columnar'):
+        read_columnar(b'XXXX' + buffer[4:])
+    with pytest.raises(ValueError, match='version'):
+        read_columnar(buffer[:4] + struct.pack('<H', 99) + buffer[6:])
+    for invalid in (buffer[:-1], buffer + b' '):
+        with pytest.raises(ValueError, match='Expected'):
+            read_columnar(invalid)
+
+
+def test_modifications_bump_version():
+    routes = as_route_table(legacy_routes())
+    versions = [routes.version]
+    for modify in (lambda: routes.append_route(['x', 'y']),
+                   lambda: routes.set_start_offsets({0: 2}),
+                   lambda: routes.remove_routes([2]),
+                   routes.clear):
+        modify()
+        assert routes.version not in versions
+        versions.append(routes.version)
+    # Removing routes that are not in the table is not a modification.
+    assert routes.remove_routes([7]) == 0
+    assert routes.version == versions[-1]
+
+
+def test_copy_keeps_version_until_modified():
+    routes = as_route_table(legacy_routes())
+    copy = routes.copy()
+    assert copy.version == routes.version
+    copy.append_route(['x'])
+    assert copy.version != routes.version
+    routes.append_route(['x'])
+    # Versions are unique across tables.
+    assert copy.version != routes.version
+    assert RouteTable.from_frame(legacy_routes()).version != \
+        as_route_table(legacy_routes()).version
+
+
+def test_route_changes():
+    old = as_route_table(legacy_routes())
+    new = old.copy()
+    assert route_changes(old, new) == ([], [])
+    new.append_route(['x', 'y'])
+    new.remove_routes([0])
+    assert route_changes(old, new) == ([3], [0])
+    # Changed routes are both removed and added.
+    new.set_start_offsets({2: 1})
+    assert route_changes(old, new) == ([2, 3], [0, 2])
+    changed = old.copy()
+    changed.remove_routes([2])
+    changed.append_route(['d', 'c'], route_i=2)
+    assert route_changes(old, changed) == ([2], [2])
+    # Electrode codes may differ between tables.
+    converted = RouteTable.from_frame(old.to_frame().iloc[::-1])
+    assert route_changes(old, converted) == ([], [])
+    assert route_changes(RouteTable(), old) == ([0, 2], [])
+
+
+def test_frame_of_rows():
+    routes = as_route_table(legacy_routes())
+    start = len(routes)
+    routes.append_route(['e', 'a'], start_offset=1)
+    df_rows = routes.to_frame(rows=slice(start, None))
+    assert df_rows.columns.tolist() == ['route_i', 'electrode_i',
+                                        'transition_i', 'start_offset']
+    assert df_rows.values.tolist() == [[3, 'e', 0, 1], [3, 'a', 1, 1]]
+    # Offset column is only included if any route in range is offset.
+    assert 'start_offset' not in routes.to_frame(rows=slice(0, start))
@@ -0,0 +1,141 @@
+'''
+Check caching of compiled schedules.
+'''
+import numpy as np
+
+from ..precompile import SchedulePrecompiler
+from ..routes import RouteTable
+from ..schedule import (ChannelMap, ScheduleCache, compile_schedule,
+                        schedule_key)
+from ..states import electrode_states
+from .helpers import random_routes
+
+
+class Sized(object):
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ScheduleCache(max_bytes=300)
+    for key in 'abc':
+        cache.put(key, Sized(100))
+    # Mark `a` as most recently used, so `b` is evicted first.
+    assert cache.get('a') is not None
+    cache.put('d', Sized(100))
+    assert sorted(cache._schedules) == ['a', 'c', 'd']
+    assert cache.nbytes == 300
+
+    # Evict as many entries as necessary, i.e., `c` then `a`.
+    cache.put('e', Sized(150))
+    assert sorted(cache._schedules) == ['d', 'e']
+    assert cache.nbytes == 250
+
+    # Replacing an entry does not count it twice.
+    cache.put('e', Sized(50))
+    assert cache.nbytes == 150
+
+
+def test_cache_skips_oversize_schedule():
+    cache = ScheduleCache(max_bytes=300)
+    cache.put('a', Sized(100))
+    cache.put('b', Sized(400))
+    assert 'b' not in cache
+    assert 'a' in cache
+    assert cache.nbytes == 100
+    cache.discard('a')
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_cache_compile_reuses_schedule():
+    df_routes = random_routes(np.random.RandomState(0))
+    cache = ScheduleCache()
+    schedule = cache.compile(df_routes, trail_length=2)
+    assert cache.compile(RouteTable.from_frame(df_routes),
+                         trail_length=2) is schedule
+    assert cache.compile(df_routes, trail_length=3) is not schedule
+    assert cache.get(schedule_key(df_routes, trail_length=2)) is schedule
+    assert cache.nbytes == sum(schedule_i.nbytes for schedule_i in
+                               cache._schedules.values())
+
+
+def test_precompiler_matches_inline_compile():
+    random = np.random.RandomState(1)
+    items = [(random_routes(random), trail_length) for trail_length in (1, 2)]
+    cache = ScheduleCache()
+    precompiler = SchedulePrecompiler(cache)
+    try:
+        keys = precompiler.submit_all(items)
+        for key, (df_routes, trail_length) in zip(keys, items):
+            schedule = precompiler.result(key)
+            expected = compile_schedule(df_routes, trail_length=trail_length)
+            assert (schedule.electrodes == expected.electrodes).all()
+            np.testing.assert_array_equal(schedule.first_pass,
+                                          expected.first_pass)
+            np.testing.assert_array_equal(schedule.cycle, expected.cycle)
+            # Compiling again reuses the background compiled schedule.
+            assert precompiler.compile(df_routes,
+                                       trail_length=trail_length) is schedule
+    finally:
+        precompiler.shutdown()
+
+
+def random_channel_map(random, electrodes=14, channels=6):
+    '''
+    Map each electrode to none, one or several random channels, including
+    electrodes that are not on any route (see :func:`random_routes`).
+    '''
+    return dict(('electrode%03d' % code,
+                 random.permutation(channels)[:random.randint(0, 3)]
+                 .tolist()) for code in xrange(electrodes))
+
+
+def test_channel_states_match_series():
+    random = np.random.RandomState(2)
+    for i in xrange(50):
+        df_routes = random_routes(random)
+        channels = random_channel_map(random)
+        trail_length = random.randint(1, 3)
+        repeats = random.randint(1, 3)
+        reduced = list(electrode_states(df_routes, trail_length=trail_length,
+                                        repeats=repeats, mode='channels',
+                                        channels=channels))
+        series = list(electrode_states(df_routes, trail_length=trail_length,
+                                       repeats=repeats))
+        assert len(reduced) == len(series)
+        for reduced_i, series_i in zip(reduced, series):
+            # Channels of electrodes in frame (i.e., of electrodes on cyclic
+            # routes in repeated passes); unmapped electrodes are dropped.
+            expected = dict((channel, False) for electrode_i in series_i.index
+                            for channel in channels[electrode_i])
+            assert reduced_i.index.tolist() == sorted(expected)
+            # A channel is on if *any* of its electrodes is on.
+            for electrode_i, state in series_i.items():
+                for channel in channels[electrode_i]:
+                    expected[channel] |= bool(state)
+            assert reduced_i.to_dict() == expected
+
+        # Reduced cycle columns are channels of electrodes on cyclic routes.
+        schedule = compile_schedule(df_routes, trail_length=trail_length)
+        channel_schedule = schedule.channel_schedule(ChannelMap(channels))
+        cyclic = schedule.electrodes[schedule.cycle_columns]
+        assert (channel_schedule.electrodes[channel_schedule.cycle_columns]
+                .tolist() == sorted(set(channel for electrode_i in cyclic
+                                        for channel in
+                                        channels[electrode_i])))
+
+
+def test_cache_reuses_channel_schedule():
+    random = np.random.RandomState(3)
+    df_routes = random_routes(random)
+    cache = ScheduleCache()
+    schedule = cache.compile(df_routes)
+    key = schedule_key(df_routes)
+    channels = random_channel_map(random)
+    reduced = cache.channel_schedule(key, schedule, ChannelMap(channels))
+    # Equal mappings share a digest, regardless of format.
+    pairs = [(electrode_i, channel) for electrode_i, channels_i in
+             channels.items() for channel in channels_i]
+    assert cache.channel_schedule(key, schedule, ChannelMap(pairs)) is reduced
+    assert len(cache) == 2
+    assert cache.nbytes == schedule.nbytes + reduced.nbytes
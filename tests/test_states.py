@@ -0,0 +1,252 @@
+'''
+Check compiled electrode states against the per-frame pandas engine of
+previous versions.
+'''
+import numpy as np
+import pandas as pd
+
+from ..schedule import PackedStates, compile_schedule
+from ..states import (RepeatDeadline, StateLoop, StatesCursor,
+                      electrode_states)
+from .helpers import random_routes
+
+
+def reference_states(df_routes, trail_length=1, repeats=1):
+    '''
+    Electrode states of :data:`df_routes`, computed frame by frame as in
+    ``states.electrode_states()`` of version 2.5.
+    '''
+    states = []
+    if df_routes.shape[0] < 1:
+        return states
+
+    route_starts = df_routes.groupby('route_i')['electrode_i'].first()
+    route_ends = df_routes.groupby('route_i')['electrode_i'].last()
+    cycles = route_starts[route_starts == route_ends]
+    cyclic_mask = df_routes.route_i.isin(cycles.index.tolist())
+
+    for j in xrange(repeats):
+        if j > 0:  # Only repeat *cyclic* routes.
+            df_routes_j = df_routes.loc[cyclic_mask].copy()
+            if df_routes_j.shape[0] < 1:
+                break
+        else:
+            df_routes_j = df_routes.copy()
+
+        route_lengths = df_routes_j.groupby('route_i')['route_i'].count()
+        df_routes_j['route_length'] = (route_lengths[df_routes_j.route_i]
+                                       .values)
+        df_routes_j['cyclic'] = (df_routes_j.route_i
+                                 .isin(cycles.index.tolist()))
+
+        for start_i in xrange(0 if j == 0 else 1, int(route_lengths.max())):
+            end_i = (start_i + trail_length - 1)
+            start_i_mod = start_i % df_routes_j.route_length
+            end_i_mod = end_i % df_routes_j.route_length
+            single_pass_mask = ((df_routes_j.transition_i >= start_i) &
+                                (df_routes_j.transition_i <= end_i))
+            second_pass_mask = (max(end_i, start_i) < 2 *
+                                df_routes_j.route_length)
+            wrap_around_mask = ((end_i_mod < start_i_mod) &
+                                ((df_routes_j.transition_i >= start_i_mod) |
+                                 (df_routes_j.transition_i <= end_i_mod + 1)))
+            active_transition_mask = (single_pass_mask |
+                                      (df_routes_j.cyclic & second_pass_mask &
+                                       wrap_around_mask))
+            df_routes_j['active'] = active_transition_mask.astype(int)
+            states.append(df_routes_j.groupby('electrode_i')['active'].sum()
+                          .astype(bool))
+    return states
+
+
+def assert_states_equal(states, expected):
+    assert len(states) == len(expected)
+    for frame_i, (states_i, expected_i) in enumerate(zip(states, expected)):
+        # "On" electrodes are listed first.
+        assert not (np.diff(states_i.values.astype(int)) > 0).any(), frame_i
+        pd.testing.assert_series_equal(states_i.sort_index(),
+                                       expected_i.sort_index(),
+                                       check_names=False)
+
+
+def test_electrode_states_match_reference():
+    random = np.random.RandomState(0)
+    for i in xrange(200):
+        df_routes = random_routes(random)
+        trail_length = random.randint(1, 6)
+        repeats = random.randint(1, 4)
+        states = list(electrode_states(df_routes, trail_length=trail_length,
+                                       repeats=repeats))
+        assert_states_equal(states, reference_states(df_routes,
+                                                     trail_length=trail_length,
+                                                     repeats=repeats))
+
+
+def test_empty_routes():
+    df_routes = random_routes(np.random.RandomState(0)).iloc[:0]
+    assert list(electrode_states(df_routes)) == []
+
+
+def mirror_states(deltas):
+    '''
+    Yield electrode states kept up to date by a consumer of delta frames.
+    '''
+    current = pd.Series(dtype=bool)
+    for delta_i in deltas:
+        current = delta_i.combine_first(current).astype(bool)
+        yield current
+
+
+def test_deltas_match_series():
+    random = np.random.RandomState(1)
+    for i in xrange(50):
+        df_routes = random_routes(random)
+        trail_length = random.randint(1, 4)
+        series = list(electrode_states(df_routes, trail_length=trail_length,
+                                       repeats=3))
+        deltas = electrode_states(df_routes, trail_length=trail_length,
+                                  repeats=3, mode='delta')
+        frames = 0
+        for states_i, current in zip(series, mirror_states(deltas)):
+            frames += 1
+            # Every electrode on in the mirror is on in the series frame.
+            on = current.index[current.values]
+            assert states_i.reindex(on).fillna(False).all()
+            pd.testing.assert_series_equal(current.loc[states_i.index],
+                                           states_i, check_names=False)
+        assert frames == len(series)
+
+
+def test_deltas_turn_off_electrodes_of_routes_not_repeated():
+    df_routes = pd.DataFrame([(0, e, i) for i, e in enumerate('abcd')] +
+                             [(1, e, i) for i, e in enumerate('xyx')],
+                             columns=['route_i', 'electrode_i',
+                                      'transition_i'])
+    deltas = list(electrode_states(df_routes, repeats=3, mode='delta'))
+    current = list(mirror_states(deltas))
+    assert current[3]['d']
+    assert not any(current_i['d'] for current_i in current[4:])
+
+
+
+def test_delta_keyframe_after_seek_covers_all_columns():
+    df_routes = pd.DataFrame([(0, e, i) for i, e in enumerate('abcda')] +
+                             [(1, e, i) for i, e in enumerate('xyz')],
+                             columns=['route_i', 'electrode_i',
+                                      'transition_i'])
+    schedule = compile_schedule(df_routes)
+    cursor = StatesCursor(schedule, repeats=3, mode='delta')
+    for i in xrange(3):
+        next(cursor)
+    # Seek into the repeated passes, i.e., the cycle block.
+    cursor.seek(schedule.first_pass.shape[0] + 1)
+    keyframe = next(cursor)
+    assert sorted(keyframe.index) == sorted(schedule.electrodes)
+    # Electrodes of routes that are not repeated are off.
+    assert not keyframe[['x', 'y', 'z']].any()
+    assert keyframe.sum() == 1
+    # Next frame only lists changes again.
+    assert set(next(cursor).index) <= set('abcd')
+
+
+def expand_runs(records):
+    '''
+    Yield frames of :class:`states.StateRun` and :class:`states.StateLoop`
+    records.
+    '''
+    for record in records:
+        if isinstance(record, StateLoop):
+            for i in xrange(record.iterations):
+                for frame in expand_runs(record.body):
+                    yield frame
+        else:
+            for i in xrange(record.count):
+                yield record.states
+
+
+def test_runs_match_series():
+    random = np.random.RandomState(2)
+    for i in xrange(50):
+        df_routes = random_routes(random)
+        trail_length = random.randint(1, 4)
+        for repeats in (1, 3):
+            series = list(electrode_states(df_routes,
+                                           trail_length=trail_length,
+                                           repeats=repeats))
+            runs = list(expand_runs(electrode_states(df_routes,
+                                                     trail_length=
+                                                     trail_length,
+                                                     repeats=repeats,
+                                                     mode='runs')))
+            assert len(runs) == len(series)
+            for states_i, run_i in zip(series, runs):
+                pd.testing.assert_series_equal(run_i, states_i)
+
+
+class VirtualClock(object):
+    def __init__(self, time=0.):
+        self.time = time
+
+    def __call__(self):
+        return self.time
+
+
+def test_repeat_deadline_passes():
+    clock = VirtualClock()
+    deadline = RepeatDeadline(10, clock=clock)
+    # Frame period is not known yet.
+    assert deadline.passes(0, 5) == 1
+    # 20 frames in 2 s, i.e., 0.5 s per pass of 5 frames: 16 whole passes
+    # fit in the remaining 8 s.
+    clock.time = 2.
+    assert deadline.passes(20, 5) == 16
+    clock.time = 10.
+    assert deadline.passes(100, 5) == 0
+    assert RepeatDeadline(0, clock=clock).passes(20, 5) == 0
+
+
+def test_repeat_duration_plays_whole_passes():
+    df_routes = pd.DataFrame([(0, e, i) for i, e in enumerate('abcda')],
+                             columns=['route_i', 'electrode_i',
+                                      'transition_i'])
+    clock = VirtualClock()
+    frames = 0
+    for frames, _ in enumerate(electrode_states(df_routes,
+                                                repeat_duration_s=10,
+                                                clock=clock), 1):
+        clock.time += .1
+    # First pass of 5 frames, then passes of 4 frames within 10 s.
+    assert (frames - 5) % 4 == 0
+    assert 9.5 <= frames * .1 <= 10
+
+
+def test_repeat_duration_starts_on_first_frame():
+    df_routes = pd.DataFrame([(0, e, i) for i, e in enumerate('abcda')],
+                             columns=['route_i', 'electrode_i',
+                                      'transition_i'])
+    clock = VirtualClock()
+    cursor = StatesCursor(compile_schedule(df_routes), repeat_duration_s=10,
+                          clock=clock)
+    # Step swapped in long before the first frame is requested.
+    clock.time = 30.
+    frames = 0
+    for frames, _ in enumerate(cursor, 1):
+        clock.time += .1
+    assert 9.5 <= frames * .1 <= 10
+
+
+def test_packed_match_series():
+    random = np.random.RandomState(3)
+    for i in xrange(50):
+        df_routes = random_routes(random)
+        trail_length = random.randint(1, 4)
+        series = list(electrode_states(df_routes, trail_length=trail_length,
+                                       repeats=3))
+        packed = list(electrode_states(df_routes, trail_length=trail_length,
+                                       repeats=3, mode='packed'))
+        assert len(packed) == len(series)
+        for states_i, packed_i in zip(series, packed):
+            pd.testing.assert_series_equal(packed_i.to_series(), states_i)
+            assert len(packed_i) == states_i.shape[0]
+            repacked = PackedStates.from_series(states_i, packed_i.electrodes)
+            pd.testing.assert_series_equal(repacked.to_series(), states_i)